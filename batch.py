@@ -0,0 +1,162 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+
+import nib4pimp
+import profiler
+
+
+def main():
+    '''Get args from command line'''
+    parser = argparse.ArgumentParser(
+        description="Let's create a lot of grids!",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("manifest", type=str, metavar="MANIFEST",
+        help="CSV file with a header or JSON lines file, one job per row/line.\n" +
+             "Fields are the long options of nib4pimp.py:\n" +
+             "font, nib-size, output-file, type, x-paper, y-paper, margins, resolution, color-mode")
+    parser.add_argument("-p", "--processes", type=int, metavar="NUMBER", default=os.cpu_count(),
+        help="Number of worker processes, default: number of CPUs")
+    parser.add_argument("--profile", type=str, metavar="FILEPATH",
+        help="Write the profile report of every job as JSON lines:\n" +
+             "the time of its phases and drawing calls of grid elements and cairo targets")
+    args = parser.parse_args()
+
+    if args.processes < 1:
+        print("[ERROR] Wrong number of processes")
+        sys.exit(1)
+
+    try:
+        rows = read_manifest(args.manifest)
+    except (OSError, ValueError) as error:
+        print("[ERROR] Cannot read the manifest: {}".format(error))
+        sys.exit(1)
+
+    return rows, args.processes, args.profile
+
+
+def read_manifest(path):
+    '''Read jobs from CSV or JSON lines manifest as the list of dicts,
+    lines which aren't JSON objects are kept as ValueError to fail their jobs only'''
+    with open(path, newline="") as manifest:
+        content = manifest.read()
+
+    if content.lstrip().startswith(("{", "[")) or path.lower().endswith((".jsonl", ".json")):
+        rows = []
+        for number, line in enumerate(content.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                row = ValueError("Line {}: {}".format(number, error))
+            if not isinstance(row, (dict, ValueError)):
+                row = ValueError("Line {}: JSON object expected".format(number))
+            rows.append(row)
+        return rows
+    else:
+        return list(csv.DictReader(content.splitlines()))
+
+
+def parse_job(row, required=("font", "nib-size", "output-file")):
+    '''Turn the manifest row into arguments with the rules of the command line, return (args, errors)'''
+    # Fields are whole option names, a prefix mustn't reach another option:
+    parser = nib4pimp.build_parser(exit_on_error=False, required=False, allow_abbrev=False)
+    # Options without values are set by true values:
+    flags = [option for action in parser._actions if action.nargs == 0 for option in action.option_strings]
+
+    argv = []
+    for field, value in row.items():
+        if value is None or str(value).strip() == "":
+            continue
+        option = "--" + field.strip().replace("_", "-")
+        if option in flags:
+            if str(value).strip().lower() in ["1", "true", "yes"]:
+                argv.append(option)
+            continue
+        argv += [option, str(value).strip()]
+
+    missing = [field for field in required if "--" + field not in argv]
+    if missing:
+        return None, ["Missing fields: " + ", ".join(missing)]
+
+    try:
+        args, unknown = parser.parse_known_args(argv)
+    except argparse.ArgumentError as error:
+        return None, [str(error)]
+    if unknown:
+        return None, ["Unknown fields: " + ", ".join(field.lstrip("-") for field in unknown if field.startswith("--"))]
+
+    if args.output_file is None:
+        return args, nib4pimp.check_values(args)
+    return args, nib4pimp.check_args(args)
+
+
+def run_job(job):
+    '''Render a single job in a worker process, never raise, return (number, ok, seconds, message, profile report)'''
+    number, args, profiled = job
+    start = time.perf_counter()
+    profile = None
+    if profiled or args.profile or args.cprofile:
+        profile = profiler.Profile(python=bool(args.cprofile))
+    try:
+        with profiler.phase(profile, "arguments"):
+            outputs = nib4pimp.split_types(args)
+            for output_args in outputs:
+                nib4pimp.adjust_args(output_args)
+            nib_mm = outputs[0].nib_size
+            outputs = [nib4pimp.prepare(output_args) for output_args in outputs]
+        if profile is not None:
+            profile.start()
+        nib4pimp.render_all(outputs, nib_mm, args.band_height, profile=profile)
+        if profile is not None:
+            profile.stop()
+            nib4pimp.write_profile(outputs, nib_mm, profile)
+    except Exception as error:
+        return number, False, time.perf_counter() - start, "{}: {}".format(type(error).__name__, error), None
+
+    report = nib4pimp.profile_report(outputs, nib_mm, profile) if profiled else None
+    return (number, True, time.perf_counter() - start, ", ".join(output_args.output_file for output_args in outputs),
+            report)
+
+
+def run_batch(rows, processes, profiled=False):
+    '''Render all valid jobs with the pool of processes,
+    return the list of (number, ok, seconds, message, profile report)'''
+    results = []
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        args, errors = (None, [str(row)]) if isinstance(row, ValueError) else parse_job(row)
+        if errors:
+            results.append((number, False, 0, "; ".join(errors), None))
+        else:
+            jobs.append((number, args, profiled))
+
+    with multiprocessing.Pool(min(processes, max(1, len(jobs)))) as pool:
+        results += pool.imap_unordered(run_job, jobs)
+
+    return sorted(results, key=lambda result: result[0])
+
+
+if __name__ == "__main__":
+    rows, processes, profile = main()
+    start = time.perf_counter()
+    results = run_batch(rows, processes, profile is not None)
+
+    for number, ok, seconds, message, report in results:
+        print("[{}] Job {}: {:.3f} s, {}".format("OK" if ok else "ERROR", number, seconds, message))
+    if profile is not None:
+        with open(profile, "w") as reports:
+            for number, ok, seconds, message, report in results:
+                if report is not None:
+                    reports.write(json.dumps(dict(report, job=number)) + "\n")
+    failed = len([result for result in results if not result[1]])
+    print("[INFO] {} jobs, {} failed, {:.3f} s total".format(len(results), failed, time.perf_counter() - start))
+
+    if failed:
+        sys.exit(1)
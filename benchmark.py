@@ -0,0 +1,341 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+
+import nib4pimp
+import png_writer
+
+# ISO paper sizes in millimeters:
+papers = {
+    "A5": (148, 210),
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "A2": (420, 594),
+    "A1": (594, 841),
+    "A0": (841, 1189)
+}
+
+
+def main():
+    '''Get args from command line'''
+    parser = argparse.ArgumentParser(
+        description="Let's measure grids!",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.required = True
+
+    scaling = commands.add_parser("scaling", formatter_class=argparse.RawTextHelpFormatter,
+        help="Time a single big PNG rendered by 1..N processes")
+    add_grid_arguments(scaling, "1", (420, 594), 600)
+    scaling.add_argument("-p", "--processes", type=int, metavar="NUMBER", default=os.cpu_count(),
+        help="Maximal number of processes, default: number of CPUs")
+
+    dots = commands.add_parser("dots", formatter_class=argparse.RawTextHelpFormatter,
+        help="Compare cairo dashes with lattices of dots")
+    add_grid_arguments(dots, "4", (841, 1189), 1200)
+    dots.add_argument("-t", "--type", type=nib4pimp.filetypes, metavar="FILETYPES", default="PDF,SVG,PNG",
+        help="Output filetypes separated by commas, default: PDF,SVG,PNG")
+
+    png = commands.add_parser("png", formatter_class=argparse.RawTextHelpFormatter,
+        help="Compare PNG compression levels and filters")
+    add_grid_arguments(png, "3", (594, 841), 600)
+    png.add_argument("-c", "--compressions", type=str, metavar="LEVEL:FILTER,...",
+        default="1:UP,6:UP,9:UP,6:NONE,6:PAETH,6:ADAPTIVE",
+        help="PNG compressions separated by commas, default: 1:UP,6:UP,9:UP,6:NONE,6:PAETH,6:ADAPTIVE")
+
+    suite = commands.add_parser("suite", formatter_class=argparse.RawTextHelpFormatter,
+        help="Measure every combination of the grids and compare the results with the baseline")
+    suite.add_argument("--fonts", type=str, metavar="FONTS", default=",".join(nib4pimp.font_dict),
+        help="Fonts separated by commas, default: all")
+    suite.add_argument("--nib-sizes", type=str, metavar="NUMBERS", default="0.2,3,30",
+        help="Nib sizes in millimeters separated by commas, default: 0.2,3,30")
+    suite.add_argument("--papers", type=str.upper, metavar="PAPERS", default="A5,A4,A0",
+        help="Paper sizes separated by commas, A5 ... A0, default: A5,A4,A0")
+    suite.add_argument("-t", "--type", type=nib4pimp.filetypes, metavar="FILETYPES", default="PDF,SVG,PNG",
+        help="Output filetypes separated by commas, default: PDF,SVG,PNG")
+    suite.add_argument("-r", "--resolutions", type=str, metavar="NUMBERS", default="72,300,1200",
+        help="Resolutions of PNG images in DPI separated by commas, default: 72,300,1200")
+    suite.add_argument("--repeat", type=int, metavar="NUMBER", default=3,
+        help="Number of runs of every measurement, the best one counts, default: 3")
+    suite.add_argument("-o", "--output-file", type=str, metavar="FILEPATH",
+        help="Write the results as JSON, it can be the baseline of the next runs")
+    suite.add_argument("--baseline", type=str, metavar="FILEPATH",
+        help="Compare the results with the JSON of the previous run, exit with 1 on regressions")
+    suite.add_argument("--threshold", type=float, metavar="PERCENT", default=10,
+        help="Allowed slowdown and memory growth against the baseline, default: 10")
+
+    args = parser.parse_args()
+
+    if args.command == "suite":
+        try:
+            args.cases = suite_cases(args)
+        except ValueError as error:
+            print("[ERROR] {}".format(error))
+            sys.exit(1)
+        if args.repeat < 1 or args.threshold < 0:
+            print("[ERROR] Wrong number of runs or threshold")
+            sys.exit(1)
+        return args
+
+    if args.command == "png":
+        try:
+            args.compressions = [nib4pimp.compression(text) for text in args.compressions.split(",")]
+        except argparse.ArgumentTypeError as error:
+            print("[ERROR] {}".format(error))
+            sys.exit(1)
+        if any(not 0 <= level <= 9 or png_filter not in png_writer.filters for level, png_filter in args.compressions):
+            print("[ERROR] Wrong PNG compression")
+            sys.exit(1)
+
+    if getattr(args, "processes", 1) < 1 or args.repeat < 1:
+        print("[ERROR] Wrong number of processes or runs")
+        sys.exit(1)
+    if args.font not in nib4pimp.font_dict:
+        print("[ERROR] Wrong font")
+        sys.exit(1)
+
+    return args
+
+
+def add_grid_arguments(parser, font, paper, resolution):
+    '''Add options of the measured grid with the defaults of the command'''
+    parser.add_argument("-f", "--font", type=str, metavar="FONT", default=font,
+        help="Number of the font as in nib4pimp.py, default: {}".format(font))
+    parser.add_argument("-n", "--nib-size", type=float, metavar="NUMBER", default=3,
+        help="Size of the nib in millimeters, default: 3")
+    parser.add_argument("-x", "--x-paper", type=int, metavar="NUMBER", default=paper[0],
+        help="Width of the paper in millimeters, default: {}".format(paper[0]))
+    parser.add_argument("-y", "--y-paper", type=int, metavar="NUMBER", default=paper[1],
+        help="Height of the paper in millimeters, default: {}".format(paper[1]))
+    parser.add_argument("-r", "--resolution", type=int, metavar="NUMBER", default=resolution,
+        help="Resolution of the image in DPI, default: {}".format(resolution))
+    parser.add_argument("--repeat", type=int, metavar="NUMBER", default=3,
+        help="Number of runs of every measurement, the best one counts, default: 3")
+
+
+class Sink:
+    '''File-like output which only counts written bytes'''
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def best_time(function, repeat):
+    '''Return the best wall time of several calls in seconds'''
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def scaling(args):
+    '''Render the same PNG with 1..N processes, print the time and the speedup'''
+    paper = (args.x_paper, args.y_paper)
+    print("[INFO] {}, nib {} mm, {}x{} mm, {} DPI".format(
+        nib4pimp.font_dict[args.font], args.nib_size, args.x_paper, args.y_paper, args.resolution))
+
+    single = None
+    for processes in range(1, args.processes + 1):
+        def run():
+            with open(os.devnull, "wb") as output:
+                nib4pimp.render_grid(args.font, args.nib_size, paper, fmt="PNG", dpi=args.resolution,
+                                     output=output, processes=processes)
+        seconds = best_time(run, args.repeat)
+        single = single or seconds
+        print("{:>3} processes: {:8.3f} s, speedup {:5.2f}x".format(processes, seconds, single/seconds))
+
+
+def dots(args):
+    '''Render the grid with dashes and with dots, print the time and the size of every output'''
+    paper = (args.x_paper, args.y_paper)
+    print("[INFO] {}, nib {} mm, {}x{} mm, {} DPI".format(
+        nib4pimp.font_dict[args.font], args.nib_size, args.x_paper, args.y_paper, args.resolution))
+
+    for filetype in args.type.split(","):
+        results = []
+        for use_dots in (False, True):
+            sink = Sink()
+            def run():
+                sink.size = 0
+                nib4pimp.render_grid(args.font, args.nib_size, paper, fmt=filetype, dpi=args.resolution,
+                                     output=sink, dots=use_dots)
+            results.append((best_time(run, args.repeat), sink.size))
+        (dash_time, dash_size), (dot_time, dot_size) = results
+        print("{:>4}: dashes {:8.3f} s {:>11} bytes, dots {:8.3f} s {:>11} bytes, speedup {:5.2f}x".format(
+            filetype, dash_time, dash_size, dot_time, dot_size, dash_time/dot_time))
+
+
+def png(args):
+    '''Render the grid with every PNG compression, print the time and the size of every image'''
+    paper = (args.x_paper, args.y_paper)
+    print("[INFO] {}, nib {} mm, {}x{} mm, {} DPI, {} CPUs".format(
+        nib4pimp.font_dict[args.font], args.nib_size, args.x_paper, args.y_paper, args.resolution, os.cpu_count()))
+
+    for level, png_filter in args.compressions:
+        sink = Sink()
+        def run():
+            sink.size = 0
+            nib4pimp.render_grid(args.font, args.nib_size, paper, fmt="PNG", dpi=args.resolution, output=sink,
+                                 png_compression=(level, png_filter))
+        print("{}:{:<8}: {:8.3f} s {:>11} bytes".format(level, png_filter, best_time(run, args.repeat), sink.size))
+
+
+def suite_cases(args):
+    '''Return the list of measured cases (font, nib size, paper, filetype, resolution), raise ValueError'''
+    fonts = [font.strip() for font in args.fonts.split(",")]
+    nib_sizes = [float(nib_size) for nib_size in args.nib_sizes.split(",")]
+    paper_names = [paper.strip() for paper in args.papers.split(",")]
+    filetypes = [filetype.strip() for filetype in args.type.split(",")]
+    resolutions = [int(resolution) for resolution in args.resolutions.split(",")]
+
+    if any(font not in nib4pimp.font_dict for font in fonts):
+        raise ValueError("Wrong font")
+    if any(not 0.2 <= nib_size <= 30 for nib_size in nib_sizes):
+        raise ValueError("Wrong nib size")
+    if any(paper not in papers for paper in paper_names):
+        raise ValueError("Wrong paper size")
+    if any(filetype not in ["PDF", "PNG", "SVG"] for filetype in filetypes):
+        raise ValueError("Wrong filetype")
+    if any(not 72 <= resolution <= 2400 for resolution in resolutions):
+        raise ValueError("Wrong resolution")
+
+    cases = []
+    for font in fonts:
+        for nib_size in nib_sizes:
+            for paper in paper_names:
+                for filetype in filetypes:
+                    # Vector formats don't depend on the resolution:
+                    for resolution in (resolutions if filetype == "PNG" else [None]):
+                        cases.append((font, nib_size, paper, filetype, resolution))
+
+    return cases
+
+
+def case_name(case):
+    '''Return the key of the case in the results'''
+    font, nib_size, paper, filetype, resolution = case
+    return "{} {}mm {} {}".format(font, nib_size, paper, filetype) + (" {}dpi".format(resolution) if resolution else "")
+
+
+def count_primitives(display_list):
+    '''Return the number of primitives painted from the display list, every repeated cell counts,
+    every lattice of dots counts once'''
+    count = 0
+    for key, ops in display_list.layers.items():
+        if key[0] == "tile":
+            count += sum(counts[0]*counts[1] for origin, size, counts in ops)*count_primitives(key[1])
+        elif key[0] == "dots":
+            count += len(ops)
+        else:
+            count += sum(len(op[1]) if op[0] in ["lines", "rectangles", "circles"] else op[0] != "line_to"
+                         for op in ops)
+
+    return count
+
+
+def measure_case(job):
+    '''Measure the case in a fresh worker process, return the result dict'''
+    case, repeat = job
+    font, nib_size, paper, filetype, resolution = case
+    args, nib_mm = nib4pimp.grid_args(font, nib_size, papers[paper], fmt=filetype, dpi=resolution or 300)
+    field = (args.x_paper, args.y_paper)
+
+    # Grids are memoised, every run compiles its own one:
+    def grid():
+        nib4pimp.cached_grid.cache_clear()
+        return nib4pimp.build_grid(args.font, args.nib_size, field, args.margins, **nib4pimp.grid_options(args))
+
+    sink = Sink()
+    def render():
+        nib4pimp.cached_grid.cache_clear()
+        sink.size = 0
+        nib4pimp.render_grid(font, nib_size, papers[paper], fmt=filetype, dpi=resolution or 300, output=sink)
+
+    grid_seconds = best_time(grid, repeat)
+    seconds = best_time(render, repeat)
+    # Linux counts the peak resident set size in kilobytes, macOS in bytes:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+
+    return {"case": case_name(case), "font": font, "nib_size": nib_size, "paper": paper, "type": filetype,
+            "resolution": resolution, "seconds": seconds, "grid_seconds": grid_seconds, "peak_rss_kb": peak_rss,
+            "bytes": sink.size, "primitives": count_primitives(grid())}
+
+
+def compare(results, baseline, threshold):
+    '''Print differences from the baseline results, return the number of regressions'''
+    previous = {result["case"]: result for result in baseline}
+    regressions = 0
+    for result in results:
+        if result["case"] not in previous:
+            continue
+        old = previous[result["case"]]
+        # Timer noise of the fastest cases is not a regression:
+        if result["seconds"] > old["seconds"]*(1 + threshold/100) and result["seconds"] - old["seconds"] > 0.005:
+            print("[ERROR] {}: {:.3f} s instead of {:.3f} s".format(result["case"], result["seconds"], old["seconds"]))
+            regressions += 1
+        if result["peak_rss_kb"] > old["peak_rss_kb"]*(1 + threshold/100):
+            print("[ERROR] {}: peak RSS {} kB instead of {} kB".format(
+                result["case"], result["peak_rss_kb"], old["peak_rss_kb"]))
+            regressions += 1
+        for field in ["bytes", "primitives"]:
+            if result[field] != old[field]:
+                print("[INFO] {}: {} {} instead of {}".format(result["case"], result[field], field, old[field]))
+
+    return regressions
+
+
+def run_suite(args):
+    '''Measure all cases one by one, every case in its own process to get its peak memory'''
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)["cases"]
+        except (OSError, ValueError, KeyError) as error:
+            print("[ERROR] Cannot read the baseline: {}".format(error))
+            sys.exit(1)
+
+    print("{:<28} {:>9} {:>9} {:>10} {:>12} {:>11}".format("case", "total s", "grid s", "peak kB", "bytes",
+                                                             "primitives"))
+    results = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(measure_case, [(case, args.repeat) for case in args.cases]):
+            print("{case:<28} {seconds:9.3f} {grid_seconds:9.3f} {peak_rss_kb:10} {bytes:12} {primitives:11}".format(
+                **result))
+            results.append(result)
+
+    if args.output_file:
+        with open(args.output_file, "w") as output:
+            json.dump({"repeat": args.repeat, "cases": results}, output, indent=1)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        print("[INFO] {} regressions against {}".format(regressions, args.baseline))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = main()
+    if args.command == "scaling":
+        scaling(args)
+    elif args.command == "dots":
+        dots(args)
+    elif args.command == "png":
+        png(args)
+    elif args.command == "suite":
+        run_suite(args)
@@ -0,0 +1,156 @@
+import io
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import nib4pimp
+import profiler
+
+
+def grid_key(args, nib_mm):
+    '''Return the content address of the grid for prepared arguments'''
+    params = {
+        "font": args.font,
+        "nib_size": args.nib_size,
+        "paper": [args.x_paper, args.y_paper],
+        "margins": args.margins,
+        "type": args.type,
+        # PDF is measured in points, the nib in millimeters is only shown in its info string:
+        "resolution": None if args.type == "PDF" else args.resolution,
+        "label": nib_mm if args.type == "PDF" else None,
+        "color_mode": args.color_mode if args.type == "PNG" else None,
+        "png_compression": list(args.png_compression) if args.type == "PNG" else None,
+        "options": nib4pimp.grid_options(args)
+    }
+
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class RenderCache:
+    '''LRU cache of rendered grids in memory with an optional size-bounded store on disk'''
+
+    def __init__(self, memory_bytes=64*1024*1024, directory=None, disk_bytes=1024*1024*1024):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # Restore the disk index, least recently used files first:
+            entries = []
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.endswith(".grid") and os.path.isfile(path):
+                    entries.append((os.path.getmtime(path), name[:-5], os.path.getsize(path)))
+            for mtime, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_used += size
+
+    def stats(self):
+        '''Return the counters and the used sizes'''
+        with self.lock:
+            return dict(self.counters, memory_used=self.memory_used, disk_used=self.disk_used,
+                        entries=len(self.memory), disk_entries=len(self.disk))
+
+    def get(self, key):
+        '''Return cached bytes or None'''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters["hits"] += 1
+                return self.memory[key]
+
+            if key in self.disk:
+                path = self.path(key)
+                try:
+                    with open(path, "rb") as cached:
+                        data = cached.read()
+                    os.utime(path)
+                except OSError:
+                    self.disk_used -= self.disk.pop(key)
+                else:
+                    self.disk.move_to_end(key)
+                    self.counters["disk_hits"] += 1
+                    self.store_memory(key, data)
+                    return data
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, data):
+        '''Store bytes in memory and on disk evicting least recently used entries'''
+        with self.lock:
+            self.store_memory(key, data)
+            if self.directory is not None and len(data) <= self.disk_bytes:
+                self.store_disk(key, data)
+
+    def store_memory(self, key, data):
+        '''Put bytes to the memory LRU, the lock must be held'''
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key))
+        if len(data) > self.memory_bytes:
+            return
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes:
+            evicted_key, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def store_disk(self, key, data):
+        '''Put bytes to the disk store, the lock must be held'''
+        path = self.path(key)
+        # Write through a temporary file, so readers never see a partial grid:
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(temp_path, "wb") as cached:
+            cached.write(data)
+        os.replace(temp_path, path)
+
+        if key in self.disk:
+            self.disk_used -= self.disk.pop(key)
+        self.disk[key] = len(data)
+        self.disk_used += len(data)
+        while self.disk_used > self.disk_bytes:
+            evicted_key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            self.counters["disk_evictions"] += 1
+            try:
+                os.remove(self.path(evicted_key))
+            except OSError:
+                pass
+
+    def path(self, key):
+        '''Return the file path of the cached grid'''
+        return os.path.join(self.directory, key + ".grid")
+
+    def render_grid(self, font, nib_mm, paper_mm=(210, 297), margins_mm=15, fmt="PDF", dpi=300, output=None,
+                    color_mode="AUTO", preview=None, lod_threshold=1, dots=False,
+                    png_compression=nib4pimp.default_png_compression, profile=None):
+        '''Cached version of nib4pimp.render_grid(), the profile counts cache hits and misses'''
+        with profiler.phase(profile, "arguments"):
+            args, nib_mm = nib4pimp.grid_args(font, nib_mm, paper_mm, margins_mm, fmt, dpi, color_mode, preview,
+                                              lod_threshold, dots, png_compression)
+        key = grid_key(args, nib_mm)
+
+        with profiler.phase(profile, "cache"):
+            data = self.get(key)
+        if profile is not None:
+            profile.count("cache", "misses" if data is None else "hits")
+        if data is None:
+            args.output_file = io.BytesIO()
+            nib4pimp.render(args, nib_mm, profile=profile)
+            data = args.output_file.getvalue()
+            self.put(key, data)
+
+        if output is None:
+            return data
+        output.write(data)
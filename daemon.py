@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+import batch
+import profiler
+from cache import RenderCache
+
+
+def main():
+    '''Get args from command line'''
+    parser = argparse.ArgumentParser(
+        description="Let's keep creating grids!\n" +
+                    "Reads render jobs as JSON lines, one reply line per job:\n" +
+                    '{"id": 1, "font": "4", "nib-size": 3, "type": "png"}\n' +
+                    "Fields are the long options of nib4pimp.py, output-file is optional:\n" +
+                    "without it the grid is returned base64-encoded in the data field.\n" +
+                    '"profile": true adds the time of phases and drawing calls to the reply.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("-s", "--socket", type=str, metavar="FILEPATH",
+        help="Listen on the Unix socket instead of stdin/stdout")
+    parser.add_argument("-w", "--workers", type=int, metavar="NUMBER", default=os.cpu_count(),
+        help="Number of concurrent renders, default: number of CPUs")
+    parser.add_argument("--cache-dir", type=str, metavar="DIRPATH",
+        help="Keep rendered grids on disk between restarts")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        print("[ERROR] Wrong number of workers")
+        sys.exit(1)
+
+    return args
+
+
+def handle_request(line, cache):
+    '''Render the job from the JSON line, return the reply dict'''
+    start = time.perf_counter()
+    reply = {"id": None, "ok": False}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("JSON object expected")
+        reply["id"] = request.pop("id", None)
+        # Profiles are returned with the reply instead of being written to files:
+        profile = profiler.Profile() if request.pop("profile", False) else None
+
+        args, errors = batch.parse_job(request, required=("font", "nib-size"))
+        if args is not None and "," in args.type:
+            errors.append("One filetype per request")
+        if errors:
+            raise ValueError("; ".join(errors))
+
+        grid = (args.font, args.nib_size, (args.x_paper, args.y_paper), args.margins, args.type, args.resolution)
+        options = {"color_mode": args.color_mode, "preview": args.preview, "lod_threshold": args.lod_threshold,
+                   "dots": args.dots, "png_compression": args.png_compression, "profile": profile}
+        if args.output_file is None:
+            reply["data"] = base64.b64encode(cache.render_grid(*grid, **options)).decode()
+        else:
+            with open(args.output_file, "wb") as output:
+                cache.render_grid(*grid, output=output, **options)
+            reply["output"] = args.output_file
+        reply["ok"] = True
+        if profile is not None:
+            reply["profile"] = profile.report()
+    except Exception as error:
+        reply["error"] = str(error)
+
+    reply["seconds"] = time.perf_counter() - start
+    return reply
+
+
+def serve_stream(lines, write, pool, workers, cache):
+    '''Handle JSON lines from the iterable, write replies as soon as they are ready'''
+    lock = threading.Lock()
+    # Do not read further than the pool can take:
+    limit = 2*workers
+    slots = threading.BoundedSemaphore(limit)
+
+    def reply(future):
+        try:
+            with lock:
+                write((json.dumps(future.result()) + "\n").encode())
+        finally:
+            slots.release()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        slots.acquire()
+        pool.submit(handle_request, line, cache).add_done_callback(reply)
+
+    # Wait for the last replies:
+    for slot in range(limit):
+        slots.acquire()
+
+
+def serve(args):
+    '''Serve render jobs from stdin or from the Unix socket until EOF or interruption'''
+    cache = RenderCache(directory=args.cache_dir)
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+
+    if args.socket is None:
+        def write(data):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        serve_stream(sys.stdin, write, pool, args.workers, cache)
+    else:
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                serve_stream((line.decode() for line in self.rfile), self.wfile.write, pool, args.workers, cache)
+
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        with socketserver.ThreadingUnixStreamServer(args.socket, Handler) as server:
+            print("[INFO] Listening on {}".format(args.socket))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        os.remove(args.socket)
+
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    serve(main())
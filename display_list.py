@@ -0,0 +1,533 @@
+import math
+import cairo
+import numpy as np
+
+
+# Raster strips of dots and of stamped cells take up to this size in bytes:
+max_strip_bytes = 64*1024*1024
+
+
+def gray_target(context):
+    '''Check if the context draws on the 8 bit grayscale image, where alpha holds the gray level'''
+    target = context.get_target()
+    return isinstance(target, cairo.ImageSurface) and target.get_format() == cairo.FORMAT_A8
+
+
+def gray_level(rgba):
+    '''Return the luminance of the color put over white'''
+    red, green, blue, alpha = rgba
+    return (0.299*red + 0.587*green + 0.114*blue)*alpha + 1 - alpha
+
+
+class DisplayList:
+    '''Context-like recorder which groups the primitives of a grid by their style
+
+    Generators from fonts.py draw on it exactly as on a cairo context. Each
+    stroke() or fill() appends the current path to the layer of the same style,
+    lines(), rectangles() and circles() add whole arrays from geometry.py to the path,
+    flush() paints every layer with a single stroke or fill in the order of
+    their first appearance (backgrounds, aux lines, main lines).
+
+    Previews set min_size in device units: smaller primitives are dropped and
+    finer dash patterns are merged into lighter solid lines. With dots set
+    generators draw dotted lines as lattices of dots instead of dashes.'''
+
+    def __init__(self, min_size=0, dots=False):
+        self.min_size = min_size
+        self.dots = dots
+        self.layers = {}
+        self.path = []
+        self.state = {
+            "source": (0, 0, 0, 1),
+            "line_width": 2.0,
+            "dash": ((), 0),
+            "line_cap": cairo.LINE_CAP_BUTT,
+            "line_join": cairo.LINE_JOIN_MITER
+        }
+        self.saved_states = []
+
+    def cell(self):
+        '''Return the empty display list for a repeating cell with the same level of detail'''
+        return DisplayList(self.min_size, self.dots)
+
+    # State:
+    def save(self):
+        self.saved_states.append(dict(self.state))
+
+    def restore(self):
+        self.state = self.saved_states.pop()
+
+    def set_source_rgba(self, red, green, blue, alpha=1):
+        self.state["source"] = (red, green, blue, alpha)
+
+    def set_line_width(self, width):
+        self.state["line_width"] = width
+
+    def set_line_cap(self, line_cap):
+        self.state["line_cap"] = line_cap
+
+    def set_line_join(self, line_join):
+        self.state["line_join"] = line_join
+
+    def set_dash(self, dashes, offset=0):
+        self.state["dash"] = (tuple(dashes), offset)
+
+    def get_line_width(self):
+        return self.state["line_width"]
+
+    def get_source_rgba(self):
+        return self.state["source"]
+
+    # Path:
+    def move_to(self, x, y):
+        self.path.append(("move_to", x, y))
+
+    def line_to(self, x, y):
+        self.path.append(("line_to", x, y))
+
+    def rectangle(self, x, y, width, height):
+        self.path.append(("rectangle", x, y, width, height))
+
+    def arc(self, xc, yc, radius, angle1, angle2):
+        self.path.append(("arc", xc, yc, radius, angle1, angle2))
+
+    def lines(self, segments):
+        '''Add the array of segments (x0, y0, x1, y1) to the path'''
+        if len(segments):
+            self.path.append(("lines", np.asarray(segments, dtype=float)))
+
+    def rectangles(self, rectangles):
+        '''Add the array of rectangles (x, y, width, height) to the path'''
+        if len(rectangles):
+            self.path.append(("rectangles", np.asarray(rectangles, dtype=float)))
+
+    def circles(self, circles):
+        '''Add the array of circles (xc, yc, radius) to the path'''
+        if len(circles):
+            self.path.append(("circles", np.asarray(circles, dtype=float)))
+
+    def new_path(self):
+        self.path = []
+
+    # Painting:
+    def stroke(self):
+        source, dash = self.state["source"], self.state["dash"]
+        if dash[0] and sum(dash[0]) < self.min_size:
+            # Dashes finer than the detail look like a lighter solid line, caps lengthen every dash:
+            caps = 0 if self.state["line_cap"] == cairo.LINE_CAP_BUTT else self.state["line_width"]
+            coverage = min(1, sum(length + caps for length in dash[0][::2])/sum(dash[0]))
+            source, dash = tuple(source[:3]) + (source[3]*coverage,), ((), 0)
+        key = ("stroke", source, self.state["line_width"], dash, self.state["line_cap"], self.state["line_join"])
+        self.layers.setdefault(key, []).extend(self.detailed(self.path))
+        self.path = []
+
+    def fill(self):
+        key = ("fill", self.state["source"])
+        self.layers.setdefault(key, []).extend(self.detailed(self.path))
+        self.path = []
+
+    def dot_lattice(self, origin, along, across, size, region):
+        '''Repeat the dot at origin + i*along + j*across inside the region rectangle (x, y, width, height),
+        the dot is the rectangle of size (length along, width across) centered at the lattice point'''
+        self.layers.setdefault(("dots", self.state["source"]), []).append((origin, along, across, size, region))
+
+    def detailed(self, path):
+        '''Drop rectangles and arcs smaller than min_size from the path'''
+        if not self.min_size:
+            return path
+        detailed = []
+        for op in path:
+            if op[0] == "rectangles":
+                op = (op[0], op[1][np.maximum(abs(op[1][:, 2]), abs(op[1][:, 3])) >= self.min_size])
+            elif op[0] == "circles":
+                op = (op[0], op[1][2*op[1][:, 2] >= self.min_size])
+            elif ((op[0] == "rectangle" and max(abs(op[3]), abs(op[4])) < self.min_size) or
+                  (op[0] == "arc" and 2*op[3] < self.min_size)):
+                continue
+            if op[0] not in ("rectangles", "circles") or len(op[1]):
+                detailed.append(op)
+        return detailed
+
+    def tile(self, cell, origin, size, counts):
+        '''Repeat the cell display list counts[0] times along x and counts[1] times along y'''
+        self.layers.setdefault(("tile", cell), []).append((origin, size, counts))
+
+    def flush(self, context):
+        '''Paint all layers on the real cairo context'''
+        gray = gray_target(context)
+        for key, ops in self.layers.items():
+            if key[0] == "tile":
+                for origin, size, counts in ops:
+                    context = paint_tiles(context, key[1], origin, size, counts)
+                continue
+            if key[0] == "dots":
+                for lattice in ops:
+                    context = paint_dots(context, key[1], *lattice)
+                continue
+
+            context.save()
+            translucent = gray and key[1][3] < 1
+            if translucent:
+                # The shape covered by the alpha of the color becomes the mask of its opaque level,
+                # so the level blends with the one under the shape as the color would:
+                context.push_group_with_content(cairo.CONTENT_ALPHA)
+                context.set_source_rgba(0, 0, 0, key[1][3])
+            elif gray:
+                # Replace the gray level under the shape, antialiased edges are blended with the previous one:
+                context.set_operator(cairo.OPERATOR_SOURCE)
+                context.set_source_rgba(0, 0, 0, gray_level(key[1]))
+            else:
+                context.set_source_rgba(*key[1])
+            if key[0] == "stroke":
+                context.set_line_width(key[2])
+                context.set_dash(*key[3])
+                context.set_line_cap(key[4])
+                context.set_line_join(key[5])
+
+            context = replay_path(context, ops)
+
+            if key[0] == "stroke":
+                context.stroke()
+            else:
+                context.fill()
+            if translucent:
+                mask = context.pop_group()
+                context.set_operator(cairo.OPERATOR_SOURCE)
+                context.set_source_rgba(0, 0, 0, gray_level(tuple(key[1][:3]) + (1,)))
+                context.mask(mask)
+            context.restore()
+
+        return context
+
+
+def replay_path(context, ops):
+    '''Build the path of display list operations on the cairo context'''
+    for op in ops:
+        if op[0] == "lines":
+            for x0, y0, x1, y1 in op[1].tolist():
+                context.move_to(x0, y0)
+                context.line_to(x1, y1)
+        elif op[0] == "rectangles":
+            for rectangle in op[1].tolist():
+                context.rectangle(*rectangle)
+        elif op[0] == "circles":
+            for xc, yc, radius in op[1].tolist():
+                context.new_sub_path()
+                context.arc(xc, yc, radius, 0, 2*math.pi)
+        else:
+            if op[0] == "arc":
+                # Do not connect the arc with the end of the previous primitive:
+                context.new_sub_path()
+            getattr(context, op[0])(*op[1:])
+
+    return context
+
+
+def whole_pixels(matrix):
+    '''Check if the user space is only moved against the pixels by whole pixels'''
+    return (matrix.xx, matrix.yx, matrix.xy, matrix.yy) == (1, 0, 0, 1) and float(matrix.x0).is_integer() and \
+        float(matrix.y0).is_integer()
+
+
+def gray_images(draw, x0, y0, width, height):
+    '''Draw in color on the image of the page area at (x0, y0), return A8 images of its coverage
+    and of its gray level premultiplied by the coverage'''
+    image = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    image_context = cairo.Context(image)
+    image_context.translate(-x0, -y0)
+    draw(image_context)
+    image.flush()
+
+    # Channels are premultiplied by the alpha, so is their luminance:
+    pixels = np.frombuffer(image.get_data(), np.uint32).reshape(height, image.get_stride()//4)[:, :width]
+    level = 0.299*(pixels >> 16 & 0xff) + 0.587*(pixels >> 8 & 0xff) + 0.114*(pixels & 0xff)
+    images = []
+    for values in (pixels >> 24, np.rint(level)):
+        gray = cairo.ImageSurface(cairo.FORMAT_A8, width, height)
+        gray.flush()
+        np.frombuffer(gray.get_data(), np.uint8).reshape(height, gray.get_stride())[:, :width] = values
+        gray.mark_dirty()
+        images.append(gray)
+    image.finish()
+
+    return images
+
+
+def paint_gray(context, images, x0, y0, rectangle, extend=False):
+    '''Put images of gray_images() at (x0, y0) over the rectangle of the 8 bit grayscale page.
+    Layers blend gray levels as colors over white, so the page is darkened by the coverage
+    and the premultiplied level is added'''
+    context.save()
+    for operator, image in zip((cairo.OPERATOR_DEST_OUT, cairo.OPERATOR_ADD), images):
+        pattern = cairo.SurfacePattern(image)
+        if extend:
+            pattern.set_extend(cairo.EXTEND_REPEAT)
+        pattern.set_matrix(cairo.Matrix(x0=-x0, y0=-y0))
+        context.set_operator(operator)
+        context.set_source(pattern)
+        context.rectangle(*rectangle)
+        context.fill()
+    context.restore()
+
+    return context
+
+
+def draw_tile(tile_context, cell, size):
+    '''Draw the cell and the overhangs of its neighbours on the tile'''
+    for dx in (-size[0], 0, size[0]):
+        for dy in (-size[1], 0, size[1]):
+            tile_context.save()
+            tile_context.translate(dx, dy)
+            tile_context = cell.flush(tile_context)
+            tile_context.restore()
+
+    return tile_context
+
+
+def stamp_cells(context, stamp, origin, size, columns, rows):
+    '''Paint the recorded cell at the columns and rows of the tiling'''
+    for row in rows:
+        for column in columns:
+            context.set_source_surface(stamp, origin[0] + column*size[0], origin[1] + row*size[1])
+            context.paint()
+
+    return context
+
+
+def paint_tiles(context, cell, origin, size, counts):
+    '''Paint the repeating cell with a single pattern or stamp it cell by cell'''
+    if counts[0] <= 0 or counts[1] <= 0:
+        return context
+
+    vector = not isinstance(context.get_target(), cairo.ImageSurface)
+    aligned = all(float(value).is_integer() for value in tuple(origin) + tuple(size))
+    region = (origin[0], origin[1], counts[0]*size[0], counts[1]*size[1])
+    gray = gray_target(context)
+
+    context.save()
+    if gray and not aligned and not whole_pixels(context.get_matrix()):
+        # Gray levels replace each other, so transparent parts of a tile can't be composited,
+        # replay the cells touching the page instead (a cell draws within its neighbours):
+        page = context.clip_extents()
+        columns = range(max(0, math.floor((page[0] - origin[0])/size[0]) - 1),
+                        min(counts[0], math.ceil((page[2] - origin[0])/size[0]) + 1))
+        rows = range(max(0, math.floor((page[1] - origin[1])/size[1]) - 1),
+                     min(counts[1], math.ceil((page[3] - origin[1])/size[1]) + 1))
+        for row in rows:
+            for column in columns:
+                context.save()
+                context.translate(origin[0] + column*size[0], origin[1] + row*size[1])
+                context = cell.flush(context)
+                context.restore()
+    elif vector or aligned:
+        if gray:
+            # One tile is drawn in color and repeated by its coverage and gray level:
+            width, height = round(size[0]), round(size[1])
+            images = gray_images(lambda tile_context: draw_tile(tile_context, cell, (width, height)),
+                                 0, 0, width, height)
+            context = paint_gray(context, images, *origin, region, extend=True)
+        else:
+            # One tile contains the cell and the overhangs of its neighbours:
+            tile = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, *size))
+            draw_tile(cairo.Context(tile), cell, size)
+
+            pattern = cairo.SurfacePattern(tile)
+            pattern.set_extend(cairo.EXTEND_REPEAT)
+            pattern.set_matrix(cairo.Matrix(x0=-origin[0], y0=-origin[1]))
+            context.set_source(pattern)
+            context.rectangle(*region)
+            context.fill()
+
+        # Outermost cells stick out of the tiled region, draw these parts where they are on the page:
+        page = context.clip_extents()
+        edge_cells = set()
+        if region[0] > page[0]:
+            edge_cells.update((0, row) for row in range(counts[1]))
+        if region[0] + region[2] < page[2]:
+            edge_cells.update((counts[0] - 1, row) for row in range(counts[1]))
+        if region[1] > page[1]:
+            edge_cells.update((column, 0) for column in range(counts[0]))
+        if region[1] + region[3] < page[3]:
+            edge_cells.update((column, counts[1] - 1) for column in range(counts[0]))
+
+        context.set_fill_rule(cairo.FILL_RULE_EVEN_ODD)
+        context.rectangle(region[0] - size[0], region[1] - size[1], region[2] + 2*size[0], region[3] + 2*size[1])
+        context.rectangle(*region)
+        context.clip()
+        for column, row in sorted(edge_cells):
+            context.save()
+            context.translate(origin[0] + column*size[0], origin[1] + row*size[1])
+            context = cell.flush(context)
+            context.restore()
+    else:
+        # Tiles can't be repeated between pixels without resampling, replay the cell instead:
+        pad = max([key[2] for key in cell.layers if key[0] == "stroke"] + [0])
+        stamp = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA,
+                                       cairo.Rectangle(-pad, -pad, size[0] + 2*pad, size[1] + 2*pad))
+        cell.flush(cairo.Context(stamp))
+        if not gray:
+            context = stamp_cells(context, stamp, origin, size, range(counts[0]), range(counts[1]))
+        else:
+            # Cells are stamped in color on strips of the page, which are put on it by coverage and gray level:
+            page = context.clip_extents()
+            left = max(math.floor(page[0]), math.floor(region[0] - pad))
+            right = min(math.ceil(page[2]), math.ceil(region[0] + region[2] + pad))
+            upper = max(math.floor(page[1]), math.floor(region[1] - pad))
+            lower = min(math.ceil(page[3]), math.ceil(region[1] + region[3] + pad))
+            columns = range(max(0, math.floor((left - pad - origin[0])/size[0])),
+                            min(counts[0], math.ceil((right + pad - origin[0])/size[0])))
+            strip_height = max(1, max_strip_bytes//(4*max(1, right - left)))
+            for top in range(upper, lower if right > left else upper, strip_height):
+                height = min(strip_height, lower - top)
+                rows = range(max(0, math.floor((top - pad - origin[1])/size[1])),
+                             min(counts[1], math.ceil((top + height + pad - origin[1])/size[1])))
+                images = gray_images(lambda strip_context: stamp_cells(strip_context, stamp, origin, size,
+                                                                       columns, rows),
+                                     left, top, right - left, height)
+                context = paint_gray(context, images, left, top, (left, top, right - left, height))
+    context.restore()
+
+    return context
+
+
+def dot_corners(center, along, size):
+    '''Return corners of the dot centered at the point and stretched along the vector'''
+    length = math.hypot(*along)
+    ux, uy = along[0]/length*size[0]/2, along[1]/length*size[0]/2
+    nx, ny = -along[1]/length*size[1]/2, along[0]/length*size[1]/2
+
+    return [(center[0] - ux - nx, center[1] - uy - ny), (center[0] + ux - nx, center[1] + uy - ny),
+            (center[0] + ux + nx, center[1] + uy + ny), (center[0] - ux + nx, center[1] - uy + ny)]
+
+
+def lattice_matrix(origin, along, across):
+    '''Return (xx, yx, xy, yy, x0, y0) of the map from the page to the pattern space,
+    where the lattice cell becomes the rectangle (0, 0, |along|, |across|)'''
+    det = along[0]*across[1] - across[0]*along[1]
+    scale_u, scale_v = math.hypot(*along)/det, math.hypot(*across)/det
+    xx, xy = scale_u*across[1], -scale_u*across[0]
+    yx, yy = -scale_v*along[1], scale_v*along[0]
+
+    return xx, yx, xy, yy, -xx*origin[0] - xy*origin[1], -yx*origin[0] - yy*origin[1]
+
+
+def dot_rows(origin, along, across, extents, radius):
+    '''Yield (start, first, last) of lattice rows start + i*along with points closer than the radius
+    to the rectangle (x0, y0, x1, y1)'''
+    length = math.hypot(*along)
+    unit = (along[0]/length, along[1]/length)
+    normal = (-unit[1], unit[0])
+    row_step = across[0]*normal[0] + across[1]*normal[1]
+
+    # Rows of the lattice crossing the rectangle:
+    distances = [(x - origin[0])*normal[0] + (y - origin[1])*normal[1]
+                 for x in (extents[0], extents[2]) for y in (extents[1], extents[3])]
+    rows = sorted(((min(distances) - radius)/row_step, (max(distances) + radius)/row_step))
+    for row in range(math.ceil(rows[0]), math.floor(rows[1]) + 1):
+        start = (origin[0] + row*across[0], origin[1] + row*across[1])
+        # Part of the row inside the rectangle:
+        low, high = -math.inf, math.inf
+        for axis in (0, 1):
+            if abs(unit[axis]) < 1e-12:
+                if not extents[axis] - radius <= start[axis] <= extents[axis + 2] + radius:
+                    low, high = 1, 0
+                continue
+            bounds = sorted(((extents[axis] - radius - start[axis])/unit[axis],
+                             (extents[axis + 2] + radius - start[axis])/unit[axis]))
+            low, high = max(low, bounds[0]), min(high, bounds[1])
+        if low <= high and math.ceil(low/length) <= math.floor(high/length):
+            yield start, math.ceil(low/length), math.floor(high/length)
+
+
+def dot_strip(matrix, origin, along, across, size, extents):
+    '''Return the repeating pattern of the A8 mask of the dots between two rows of the lattice over the extents,
+    None unless the rows follow each other down the page by whole pixels or when the strip is too big'''
+    period = round(across[1])
+    if not whole_pixels(matrix):
+        return None
+    if across[0] or period < 1 or abs(across[1] - period) > 1e-6:
+        return None
+    x0, y0 = math.floor(extents[0]), math.floor(extents[1])
+    width = math.ceil(extents[2]) - x0
+    if width < 1 or width*period > max_strip_bytes:
+        return None
+
+    strip = cairo.ImageSurface(cairo.FORMAT_A8, width, period)
+    strip_context = cairo.Context(strip)
+    strip_context.translate(-x0, -y0)
+    # Dots of all rows sticking into the strip:
+    for start, first, last in dot_rows(origin, along, (0, period), (x0, y0, x0 + width, y0 + period),
+                                       math.hypot(*size)/2):
+        for index in range(first, last + 1):
+            corners = dot_corners((start[0] + index*along[0], start[1] + index*along[1]), along, size)
+            strip_context.move_to(*corners[0])
+            for corner in corners[1:]:
+                strip_context.line_to(*corner)
+            strip_context.close_path()
+    strip_context.fill()
+    strip.flush()
+
+    pattern = cairo.SurfacePattern(strip)
+    pattern.set_extend(cairo.EXTEND_REPEAT)
+    pattern.set_filter(cairo.FILTER_NEAREST)
+    pattern.set_matrix(cairo.Matrix(x0=-x0, y0=-y0))
+    return pattern
+
+
+def paint_dots(context, rgba, origin, along, across, size, region):
+    '''Paint the lattice of dots with a single pattern, on raster targets mask the page by a repeating strip
+    of dots or stroke its rows with a single dash pattern'''
+    context.save()
+    context.rectangle(*region)
+    context.clip()
+
+    if not isinstance(context.get_target(), cairo.ImageSurface):
+        # Vector targets keep one dot and repeat it through the sheared pattern:
+        matrix = lattice_matrix(origin, along, across)
+        tile = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA,
+                                      cairo.Rectangle(0, 0, math.hypot(*along), math.hypot(*across)))
+        tile_context = cairo.Context(tile)
+        tile_context.transform(cairo.Matrix(*matrix[:4]))
+        tile_context.set_source_rgba(*rgba)
+        # The dot and its neighbours sticking into the cell:
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                corners = dot_corners((i*along[0] + j*across[0], i*along[1] + j*across[1]), along, size)
+                tile_context.move_to(*corners[0])
+                for corner in corners[1:]:
+                    tile_context.line_to(*corner)
+                tile_context.close_path()
+        tile_context.fill()
+
+        pattern = cairo.SurfacePattern(tile)
+        pattern.set_extend(cairo.EXTEND_REPEAT)
+        pattern.set_matrix(cairo.Matrix(*matrix))
+        context.set_source(pattern)
+        context.paint()
+    else:
+        if gray_target(context):
+            context.set_operator(cairo.OPERATOR_SOURCE)
+            context.set_source_rgba(0, 0, 0, gray_level(rgba))
+        else:
+            context.set_source_rgba(*rgba)
+        strip = dot_strip(context.get_matrix(), origin, along, across, size, context.clip_extents())
+        if strip is not None:
+            # Rows repeat by whole pixels, the strip between two rows is filled once and masks the whole page:
+            context.mask(strip)
+            context.restore()
+            return context
+
+        # Otherwise every row is stroked once, rows start at a dot, so one dash pattern fits all of them:
+        length = math.hypot(*along)
+        unit = (along[0]/length, along[1]/length)
+        context.set_line_width(size[1])
+        context.set_line_cap(cairo.LINE_CAP_BUTT)
+        context.set_dash([size[0], length - size[0]] if length > size[0] else [])
+        half = (unit[0]*size[0]/2, unit[1]*size[0]/2)
+        for start, first, last in dot_rows(origin, along, across, context.clip_extents(), math.hypot(*size)/2):
+            context.move_to(start[0] + first*along[0] - half[0], start[1] + first*along[1] - half[1])
+            context.line_to(start[0] + last*along[0] + half[0], start[1] + last*along[1] + half[1])
+        context.stroke()
+    context.restore()
+
+    return context
@@ -1,5 +1,8 @@
 import math
 import cairo
+import numpy as np
+
+import geometry
 
 main_line = [0.6, 0.6, 0.6, 1]
 aux_line =  [0.866, 0.866, 0.866, 1]
@@ -10,338 +13,327 @@ aux_line_width = 0.3
 
 mark_width = 4
 
-def roman_square_capitals(surface, context, step, field, margins):
-    '''This function realizes the grid for the roman square capitals'''
+
+def rustic_ustav_minuscule(name, multiplier):
+    '''Return the grid specification of the rustic, ustav, half-ustav and minuscule'''
+    return {
+        "name": name,
+        "period": multiplier + 3,
+        "elements": [
+            {"kind": "fills", "offset": -1.5, "height": 3},
+            {"kind": "lines", "lines": [(main_line, [1.5, multiplier + 1.5])]},
+            {"kind": "checkmates", "lower": multiplier + 1.5, "upper": 1.5}
+        ]
+    }
+
+
+# Grids are described by their elements drawn in the order of the list. Lengths are in units,
+# the unit is the nib width multiplied by the unit of the grid, a line of writing repeats every period.
+#   fills      - background bands starting at the offset from every line of writing
+#   diagonals  - lines at the angle in degrees and spacing units apart along the line of writing,
+#                rise lifts their right end, start shifts them down
+#   columns    - vertical lines at the offsets repeated every period along the page,
+#                from/to limit them to a part of every line of writing
+#   lines      - horizontal lines at the offsets from every line of writing grouped by their colors
+#   checkmates - marks of the nib width from lower up to upper
+#   cells      - shapes of the cell repeated over the page
+# Dotted diagonals and lines take (dash length in device units, gap in units).
+grids = {
+    "1": {
+        "name": "Roman square capitals",
+        "period": 12,
+        "elements": [
+            {"kind": "cells", "size": (12, 12), "shapes": [
+                # Surrounding rectangles, the small squares are dropped by previews:
+                {"color": aux_line,
+                 "rectangles": [(1, 0, 10, 1), (1, 11, 10, 1), (0, 1, 1, 10), (11, 1, 1, 10)] +
+                               [(1 + x, 1 + y, 1, 1) for y in range(10) for x in range(10)]},
+                {"color": aux_line, "width": aux_line_width,
+                 "circles": [(x, y, 0.96) for y in [2, 10] for x in [1, 4, 8, 11]]},
+                # Main square and lines:
+                {"color": main_line, "rectangles": [(1, 1, 10, 10)], "lines": [(6, 0, 6, 12), (0, 6, 12, 6)]}
+            ]}
+        ]
+    },
+    "2": {
+        "name": "Antiqua Sans",
+        "unit": math.cos(math.radians(25)),
+        "period": 8,
+        "elements": [
+            {"kind": "fills", "offset": 0, "height": 2},
+            {"kind": "diagonals", "angle": 25, "spacing": 1/math.tan(math.radians(25)), "start": 1, "rise": 1,
+             "color": aux_line},
+            {"kind": "columns", "period": 6, "offsets": [2, 3], "from": 2, "to": 8, "color": aux_line},
+            {"kind": "lines", "lines": [(main_line, [2, 8])]},
+            {"kind": "checkmates", "lower": 8, "upper": 2}
+        ]
+    },
+    "3": {
+        "name": "Blackletter",
+        "unit": math.cos(math.radians(30)),
+        "period": 9,
+        "elements": [
+            {"kind": "fills", "offset": -2, "height": 4},
+            {"kind": "columns", "period": 1, "offsets": [0], "color": aux_line},
+            {"kind": "lines", "lines": [(aux_line, [0, 3, 4, 5, 6]), (main_line, [2, 7])]},
+            {"kind": "checkmates", "lower": 7, "upper": 2}
+        ]
+    },
+    "4": {
+        "name": "Italic",
+        "period": 10,
+        "elements": [
+            {"kind": "diagonals", "angle": 45, "spacing": 2.5, "dotted": (0.5, 0.25), "color": aux_line},
+            {"kind": "fills", "offset": -2.5, "height": 5},
+            {"kind": "diagonals", "angle": 80, "spacing": 5, "color": aux_line},
+            {"kind": "lines", "period": 5, "lines": [(main_line, [2.5])]},
+            {"kind": "lines", "period": 5, "lines": [(main_line, [5])], "dotted": (0.1, 0.25)},
+            {"kind": "checkmates", "lower": 7.5, "upper": 2.5}
+        ]
+    },
+    "5": {
+        "name": "Copperplate",
+        "period": 2,
+        "elements": [
+            {"kind": "fills", "offset": 0, "height": 1},
+            {"kind": "diagonals", "angle": 66, "spacing": 1/1.75, "color": aux_line},
+            {"kind": "lines", "period": 1, "lines": [(aux_line, [0])]}
+        ]
+    },
+    "6": rustic_ustav_minuscule("Rustic", 6),
+    "7": rustic_ustav_minuscule("Insular script, Uncial, Ustav", 5),
+    "8": rustic_ustav_minuscule("Half-ustav", 4),
+    "9": rustic_ustav_minuscule("Caroline minuscule", 3)
+}
+
+
+def draw(surface, context, grid, step, field, margins, counting=None):
+    '''This function realizes the grid from its specification,
+    counting(context, kind) may wrap the context of every element to count its drawing calls'''
     context.set_line_width(main_line_width)
     context.set_line_cap(cairo.LINE_CAP_SQUARE)
     context.set_line_join(cairo.LINE_JOIN_MITER)
 
-    xpos = margins + main_line_width*2
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        while xpos < field[0]:
-            # Surrounding rectangles:
-            context.set_source_rgba(*aux_line)
-                # x, y, width, height
-            for args in [(step,    0,       10*step, step),
-                         (step,    11*step, 10*step, step),
-                         (0,       step,    step,    10*step),
-                         (11*step, step,    step,    10*step)]:
-                context.rectangle(xpos + args[0], ypos + args[1], args[2], args[3])
-                context.stroke()
-
-            # Circles:
-            context.set_line_width(aux_line_width)
-                # x, y
-            for args in [(1*step,    2*step),
-                         (4*step,    2*step),
-                         (8*step,    2*step),
-                         (11*step,   2*step),
-                         (1*step,    10*step),
-                         (4*step,    10*step),
-                         (8*step,    10*step),
-                         (11*step,   10*step)]:
-                context.arc(xpos + args[0], ypos + args[1], step*0.96, 0, 2*math.pi)
-                context.stroke()
-
-            # Small squares:
-            context.set_line_width(main_line_width)
-            for y in range(0,10):
-                for x in range(0,10):
-                    context.rectangle(xpos + (1 + x)*step, ypos + (1 + y)*step, step, step)
-                    context.stroke()
-
-            # Main squares:
-            context.set_source_rgba(*main_line)
-            context.rectangle(xpos + step, ypos + step, 10*step, 10*step)
-            context.stroke()
-
-            # Main lines:
-            context.move_to(xpos + 6*step, ypos)
-            context.line_to(xpos + 6*step, ypos + 12*step)
-            context.move_to(xpos, ypos + 6*step)
-            context.line_to(xpos + 12*step, ypos + 6*step)
-            context.stroke()
-
-            xpos += 12*step
-        xpos = margins + main_line_width*2
-        ypos += 12*step
+    for element in grid["elements"]:
+        element_context = context if counting is None else counting(context, element["kind"])
+        surface, element_context = element_kinds[element["kind"]](surface, element_context, grid, element, step,
+                                                                   field, margins)
 
     return surface, context
 
 
-def antiqua_sans(surface, context, step, field, margins):
-    '''This function realizes the grid for the antiqua sans'''
-    # Define multiplier for this grid:
-    multiplier = math.cos(math.radians(25))
-
-    context.set_line_width(main_line_width)
-    context.set_line_cap(cairo.LINE_CAP_SQUARE)
-    context.set_line_join(cairo.LINE_JOIN_MITER)
-
-    # Filled rectangles:
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        context.set_source_rgba(*bg_color)
-        context.rectangle(0, ypos, field[0], 2*multiplier*step)
-        context.fill()
-        ypos += 8*multiplier*step
-
-    # Find the vertical delta for a 25 degrees line for chosen paper:
-    y_delta = field[0]*math.tan(math.radians(25))
-    # Diagonal lines:
-    ypos = margins + main_line_width*2
-    context.set_source_rgba(*aux_line)
-    while ypos < field[1] + y_delta:
-        context.move_to(0, ypos + multiplier*step)
-        context.line_to(field[0], ypos - y_delta)
-        context.stroke()
-        ypos += multiplier*step
-
-    xpos = margins + main_line_width*2
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        # Aux vertical lines:
-        while xpos < field[0]:
-            context.set_source_rgba(*aux_line)
-            context.move_to(xpos + 2*multiplier*step, ypos + 2*multiplier*step)
-            context.line_to(xpos + 2*multiplier*step, ypos + 8*multiplier*step)
-            context.move_to(xpos + 3*multiplier*step, ypos + 2*multiplier*step)
-            context.line_to(xpos + 3*multiplier*step, ypos + 8*multiplier*step)
-            context.stroke()
-            xpos += 6*multiplier*step
-        xpos = margins + main_line_width*2
-
-        # Main horizontal lines:
-        context.set_source_rgba(*main_line)
-        context.move_to(0, ypos + 2*multiplier*step)
-        context.line_to(field[0], ypos + 2*multiplier*step)
-        context.move_to(0, ypos + 8*multiplier*step)
-        context.line_to(field[0], ypos + 8*multiplier*step)
-        context.stroke()
-        ypos += 8*multiplier*step
+def fills(surface, context, grid, element, step, field, margins):
+    '''This function realizes the background bands of every line of writing'''
+    unit = grid.get("unit", 1)*step
+    period = element.get("period", grid["period"])*unit
 
-    # Checkmates:
-    surface, context = checkmates(surface, context, margins, field[1], step, 8*multiplier, 2*multiplier, 8*multiplier)
+    context.set_source_rgba(*bg_color)
+    context.rectangles(geometry.bands(
+        geometry.periods(margins + main_line_width*2 + element["offset"]*unit, field[1] - margins, period),
+        margins, field[0] - 2*margins, element["height"]*unit))
+    context.fill()
 
     return surface, context
 
 
-def blackletter(surface, context, step, field, margins):
-    '''This function realizes the grid for the blackletter'''
-    # Define multiplier for this grid:
-    multiplier = math.cos(math.radians(30))
+def diagonals(surface, context, grid, element, step, field, margins):
+    '''This function realizes the slanted lines through the page'''
+    unit = grid.get("unit", 1)*step
+    slope = math.tan(math.radians(element["angle"]))
+    # Find the vertical delta for the line through the paper and between the lines:
+    y_delta = field[0]*slope + element.get("rise", 0)*unit
+    y_step = element["spacing"]*unit*slope
+    ystart = margins + main_line_width*2 + element.get("start", 0)*unit
+    dotted = element.get("dotted")
+
+    context.set_source_rgba(*element["color"])
+    # Previews merge dashes into lines, dots are for the full detail:
+    if dotted and context.dots and not context.min_size:
+        return dotted_lines(surface, context, (0, ystart), (field[0], -y_delta), (dotted[0], dotted[1]*unit),
+                            (0, y_step), (margins, margins, field[0] - 2*margins, field[1] - 2*margins))
+
+    if dotted:
+        context.set_dash([dotted[0], dotted[1]*unit])
+    surface, context = diagonal_lines(surface, context, field, margins, ystart, y_step, y_delta,
+                                      dotted[0] + dotted[1]*unit if dotted else 0)
+    context.stroke()
+    context.set_dash([])
 
-    context.set_line_width(main_line_width)
-    context.set_line_cap(cairo.LINE_CAP_SQUARE)
-    context.set_line_join(cairo.LINE_JOIN_MITER)
+    return surface, context
 
-    # Filled rectangles:
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        context.set_source_rgba(*bg_color)
-        context.rectangle(0, ypos - 2*multiplier*step, field[0], 4*multiplier*step)
-        context.fill()
-        ypos += 9*multiplier*step
-
-    # Aux vertical lines:
-    xpos = margins + main_line_width*2
-    ypos = margins + main_line_width*2
-    context.set_source_rgba(*aux_line)
-    while xpos < field[0]:
-        context.move_to(xpos, 0)
-        context.line_to(xpos, field[1])
-        xpos += multiplier*step
-        context.stroke()
 
-    while ypos < field[1]:
-        # Aux horizontal lines:
-        context.set_source_rgba(*aux_line)
-        for arg in [0, 3, 4, 5, 6]:
-            context.move_to(0, ypos + arg*multiplier*step)
-            context.line_to(field[0], ypos + arg*multiplier*step)
-            context.stroke()
-        # Main horizontal lines:
-        context.set_source_rgba(*main_line)
-        context.move_to(0, ypos + 2*multiplier*step)
-        context.line_to(field[0], ypos + 2*multiplier*step)
-        context.move_to(0, ypos + 7*multiplier*step)
-        context.line_to(field[0], ypos + 7*multiplier*step)
+def columns(surface, context, grid, element, step, field, margins):
+    '''This function realizes the vertical lines repeated along the page'''
+    unit = grid.get("unit", 1)*step
+    period = element["period"]*unit
+    offsets = element["offsets"]
+    origin = margins + main_line_width*2
+
+    if "from" in element and len(offsets) > 1 and (max(offsets) - min(offsets))*unit < context.min_size:
+        # Lines closer than the detail of the preview merge into lighter lines through the page:
+        context.save()
+        context.set_source_rgba(*element["color"][:3],
+                                element["color"][3]*(element["to"] - element["from"])/grid["period"])
+        context.set_line_width(len(offsets)*main_line_width)
+        context.lines(geometry.vertical_lines(geometry.periods(origin, field[0] - margins, period) +
+                                              sum(offsets)/len(offsets)*unit, origin, field[1] - margins))
         context.stroke()
-        ypos += 9*multiplier*step
-
-    # Checkmates:
-    surface, context = checkmates(surface, context, margins, field[1], step, 7*multiplier, 2*multiplier, 9*multiplier)
+        context.restore()
+        return surface, context
+
+    cell = context.cell()
+    cell.set_line_width(main_line_width)
+    cell.set_line_cap(cairo.LINE_CAP_SQUARE)
+    cell.set_source_rgba(*element["color"])
+    if "from" in element:
+        # The same cell repeated over the page:
+        height = grid["period"]*unit
+        cell.lines(geometry.vertical_lines([offset*unit for offset in offsets],
+                                           element["from"]*unit, element["to"]*unit))
+        cell.stroke()
+        context.tile(cell, (origin, origin), (period, height),
+                     (geometry.repeats(origin, field[0] - margins, period),
+                      geometry.repeats(origin, field[1] - margins, height)))
+    else:
+        # Lines through the page repeated along the page:
+        cell.lines(geometry.vertical_lines([offset*unit for offset in offsets], 0, field[1] - 2*margins))
+        cell.stroke()
+        context.tile(cell, (origin, margins), (period, field[1] - 2*margins),
+                     (geometry.repeats(origin, field[0] - margins, period), 1))
 
     return surface, context
 
 
-def italic(surface, context, step, field, margins):
-    '''This function realizes the grid for the italic'''
-    context.set_line_width(main_line_width)
-    context.set_line_cap(cairo.LINE_CAP_SQUARE)
-    context.set_line_join(cairo.LINE_JOIN_MITER)
+def lines(surface, context, grid, element, step, field, margins):
+    '''This function realizes the horizontal lines of every line of writing'''
+    unit = grid.get("unit", 1)*step
+    period = element.get("period", grid["period"])*unit
+    origin = margins + main_line_width*2
+    dotted = element.get("dotted")
+
+    if not dotted:
+        # One line of writing repeated down the page:
+        cell = context.cell()
+        cell.set_line_width(main_line_width)
+        cell.set_line_cap(cairo.LINE_CAP_SQUARE)
+        for color, offsets in element["lines"]:
+            cell.set_source_rgba(*color)
+            cell.lines(geometry.horizontal_lines([offset*unit for offset in offsets], 0, field[0] - 2*margins))
+            cell.stroke()
+        context.tile(cell, (margins, origin), (field[0] - 2*margins, period),
+                     (1, geometry.repeats(origin, field[1] - margins, period)))
+        return surface, context
+
+    rows = geometry.periods(origin, field[1] - margins, period)
+    dash = (dotted[0], dotted[1]*unit)
+    # Dashed lines start at a whole number of dash periods to keep the dashes in place:
+    dash_start = math.floor(margins/sum(dash))*sum(dash)
+    for color, offsets in element["lines"]:
+        context.set_source_rgba(*color)
+        for offset in offsets:
+            ypos = (rows + offset*unit).tolist()
+            if context.dots and not context.min_size:
+                if ypos:
+                    surface, context = dotted_lines(surface, context, (0, ypos[0]), (1, 0), dash, (0, period),
+                                                    (margins, ypos[0] - main_line_width, field[0] - 2*margins,
+                                                     ypos[-1] - ypos[0] + 2*main_line_width))
+                continue
+            context.set_dash(dash)
+            context.lines(geometry.horizontal_lines(ypos, dash_start, field[0] - margins))
+            context.stroke()
+            context.set_dash([])
 
-    # Find the vertical delta for a 45 degrees line for chosen paper:
-    y_delta = field[0]*math.tan(math.radians(45))
-    # Find the vertical delta between 45 degrees diagonal lines:
-    y_step = 2.5*step*math.tan(math.radians(45))
-    # 45 degrees diagonal lines:
-    ypos = margins + main_line_width*2
-    context.set_source_rgba(*aux_line)
-    context.set_dash([0.5, step/4])
-    while ypos < field[1] + y_delta:
-        context.move_to(0, ypos)
-        context.line_to(field[0], ypos - y_delta)
-        ypos += y_step
-    context.stroke()
-    context.set_dash([])
+    return surface, context
 
-    # Filled rectangles:
-    ypos = -2.5*step + margins + main_line_width*2
-    while ypos < field[1]:
-        context.set_source_rgba(*bg_color)
-        context.rectangle(0, ypos, field[0], 5*step)
-        context.fill()
-        ypos += 10*step
-
-    # Find the vertical delta for a 80 degrees line for chosen paper:
-    y_delta = field[0]*math.tan(math.radians(80))
-    # Find the vertical delta between 80 degrees diagonal lines:
-    y_step = 5*step*math.tan(math.radians(80))
-    # 80 degrees diagonal lines:
-    ypos = margins + main_line_width*2
-    context.set_source_rgba(*aux_line)
-    context.set_dash([])
-    while ypos < field[1] + y_delta:
-        context.move_to(0, ypos)
-        context.line_to(field[0], ypos - y_delta)
-        context.stroke()
-        ypos += y_step
-
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        # Main lines:
-        context.set_source_rgba(*main_line)
-        context.set_dash([])
-        context.move_to(0, ypos + 2.5*step)
-        context.line_to(field[0], ypos + 2.5*step)
-        context.stroke()
-        # Dashed lines:
-        context.set_source_rgba(*main_line)
-        context.set_dash([0.1, step/4])
-        context.move_to(0, ypos + 5*step)
-        context.line_to(field[0], ypos + 5*step)
-        context.stroke()
-        ypos += 5*step
 
-    # Checkmates:
-    surface, context = checkmates(surface, context, margins, field[1], step, 7.5, 2.5, 10)
+def cells(surface, context, grid, element, step, field, margins):
+    '''This function realizes the cell of shapes repeated over the page'''
+    unit = grid.get("unit", 1)*step
+    size = (element["size"][0]*unit, element["size"][1]*unit)
+    origin = margins + main_line_width*2
+
+    # The cell is drawn once and repeated over the page:
+    cell = context.cell()
+    cell.set_line_cap(cairo.LINE_CAP_SQUARE)
+    cell.set_line_join(cairo.LINE_JOIN_MITER)
+    for shape in element["shapes"]:
+        cell.set_source_rgba(*shape["color"])
+        cell.set_line_width(shape.get("width", main_line_width))
+        cell.rectangles(np.asarray(shape.get("rectangles", []), dtype=float)*unit)
+        cell.circles(np.asarray(shape.get("circles", []), dtype=float)*unit)
+        cell.lines(np.asarray(shape.get("lines", []), dtype=float)*unit)
+        cell.stroke()
+
+    context.tile(cell, (origin, origin), size,
+                 (geometry.repeats(origin, field[0] - margins, size[0]),
+                  geometry.repeats(origin, field[1] - margins, size[1])))
 
     return surface, context
 
 
-def copperplate(surface, context, step, field, margins):
-    '''This function realizes the grid for the copperplate'''
-    context.set_line_width(main_line_width)
-    context.set_line_cap(cairo.LINE_CAP_SQUARE)
-    context.set_line_join(cairo.LINE_JOIN_MITER)
+def diagonal_lines(surface, context, field, margins, ystart, y_step, y_delta, dash_period=0):
+    '''This function realizes the parallel lines from (0, ypos) to (field[0], ypos - y_delta) clipped by the margins'''
+    length = math.hypot(field[0], y_delta)
 
-    # Filled rectangles:
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        ypos = margins + main_line_width*2
-        while ypos < field[1]:
-            context.set_source_rgba(*bg_color)
-            context.rectangle(0, ypos, field[0], step)
-            context.fill()
-            ypos += 2*step
-
-    # Find the vertical delta for a 66 degrees line for chosen paper:
-    y_delta = field[0]*math.tan(math.radians(66))
-    # Find the vertical delta between diagonal lines:
-    y_step = (step/1.75)*math.tan(math.radians(66))
-    # Diagonal lines:
-    ypos = margins + main_line_width*2
-    context.set_source_rgba(*aux_line)
-    while ypos < field[1] + y_delta:
-        context.move_to(0, ypos)
-        context.line_to(field[0], ypos - y_delta)
-        context.stroke()
-        ypos += y_step
+    if y_step*field[0]/length < context.min_size:
+        # Lines closer than the detail of the preview merge into the tint of the printable area:
+        red, green, blue, alpha = context.get_source_rgba()
+        context.save()
+        context.set_source_rgba(red, green, blue, alpha*min(1, context.get_line_width()*length/(y_step*field[0])))
+        context.rectangle(margins, margins, field[0] - 2*margins, field[1] - 2*margins)
+        context.fill()
+        context.restore()
+        return surface, context
 
-    # Horizontal lines:
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        context.move_to(0, ypos)
-        context.line_to(field[0], ypos)
-        context.stroke()
-        ypos += step
+    context.lines(geometry.diagonal_lines(field, margins, ystart, y_step, y_delta, dash_period))
 
     return surface, context
 
 
-def rustic_ustav_minuscule(surface, context, step, field, margins, multiplier):
-    '''This function realizes the grid for the rustic, ustav, half-ustav and minuscule'''
-    context.set_line_width(main_line_width)
-    context.set_line_cap(cairo.LINE_CAP_SQUARE)
-    context.set_line_join(cairo.LINE_JOIN_MITER)
+def dotted_lines(surface, context, start, direction, dash, across, region):
+    '''This function realizes parallel lines dashed with square caps through start + j*across as one lattice of dots'''
+    length = math.hypot(*direction)
+    unit = (direction[0]/length, direction[1]/length)
+    width = context.get_line_width()
 
-    # Filled rectangles:
-    ypos = margins + main_line_width*2
-    while ypos < field[1]:
-        ypos = -1.5*step + margins + main_line_width*2
-        while ypos < field[1]:
-            context.set_source_rgba(*bg_color)
-            context.rectangle(0, ypos, field[0], 3*step)
-            context.fill()
-            ypos += (multiplier + 3)*step
-
-    # Horizontal lines:
-    ypos = margins + main_line_width*2
-    xpos = margins + main_line_width*2
-    while ypos < field[1]:
-        context.set_source_rgba(*main_line)
-        context.move_to(0, ypos + 1.5*step)
-        context.line_to(field[0], ypos + 1.5*step)
-        context.move_to(0, ypos + (multiplier + 1.5)*step)
-        context.line_to(field[0], ypos + (multiplier + 1.5)*step)
-        context.stroke()
-        ypos += (multiplier + 3)*step
-
-    # Checkmates:
-    surface, context = checkmates(surface, context, margins, field[1], step, multiplier + 1.5, 1.5, multiplier + 3)
+    # Dashes start at the start of every line, the dot is the dash with its caps:
+    context.dot_lattice((start[0] + unit[0]*dash[0]/2, start[1] + unit[1]*dash[0]/2),
+                        (unit[0]*sum(dash), unit[1]*sum(dash)), across, (dash[0] + width, width), region)
 
     return surface, context
 
 
-def checkmates(surface, context, margins, height, step, lower, upper, big_step):
+def checkmates(surface, context, grid, element, step, field, margins):
     '''This function realizes the checkmates pattern in the beginning of the each line'''
+    unit = grid.get("unit", 1)
+    lower, upper = element["lower"]*unit, element["upper"]*unit
+    big_step = element.get("period", grid["period"])*unit
+
     context.save()
 
-    ypos = margins + main_line_width*2
-    xpos = margins + main_line_width*2
+    origin = margins + main_line_width*2
     context.set_source_rgba(*main_line)
     context.set_dash([])
 
-    while ypos < height:
-        mark_y = ypos + lower*step
-        mark_x = xpos + mark_width
-        while mark_y - step >= ypos + upper*step:
-            context.rectangle(mark_x, mark_y, mark_width, -step)
-            context.fill()
-            if mark_x == xpos + mark_width:
-                mark_x = xpos
-            else:
-                mark_x = xpos + mark_width
-            mark_y -= step
-        # Last mark - in case it should be short:
-        if mark_y - step < ypos + upper*step:
-            context.rectangle(mark_x, mark_y, mark_width, -mark_y + (ypos + upper*step))
-            context.fill()
-
-        ypos += big_step*step
+    if step < context.min_size:
+        # Marks shorter than the detail of the preview merge into the half-tone column:
+        context.set_source_rgba(*main_line[:3], main_line[3]/2)
+        context.rectangles(geometry.bands(geometry.periods(origin, field[1] - margins, big_step*step) + upper*step,
+                                          origin, 2*mark_width, (lower - upper)*step))
+    else:
+        context.rectangles(geometry.checkmates(origin, field[1] - margins, step, lower, upper, big_step, mark_width))
+    context.fill()
 
     context.restore()
 
-    return surface, context
\ No newline at end of file
+    return surface, context
+
+
+element_kinds = {
+    "fills": fills,
+    "diagonals": diagonals,
+    "columns": columns,
+    "lines": lines,
+    "checkmates": checkmates,
+    "cells": cells
+}
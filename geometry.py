@@ -0,0 +1,92 @@
+import math
+import numpy as np
+
+# Shapes of the arrays of primitives:
+#   segments   - (N, 4) of x0, y0, x1, y1
+#   rectangles - (N, 4) of x, y, width, height
+#   circles    - (N, 3) of xc, yc, radius
+
+
+def repeats(start, end, period):
+    '''Return the number of periods started before the end'''
+    return max(0, math.ceil((end - start)/period))
+
+
+def periods(start, end, period):
+    '''Return positions start + i*period before the end'''
+    return start + period*np.arange(repeats(start, end, period))
+
+
+def horizontal_lines(ys, left, right):
+    '''Return segments from left to right at every y'''
+    ys = np.asarray(ys, dtype=float)
+    return np.column_stack((np.full_like(ys, left), ys, np.full_like(ys, right), ys))
+
+
+def vertical_lines(xs, top, bottom):
+    '''Return segments from top to bottom at every x'''
+    xs = np.asarray(xs, dtype=float)
+    return np.column_stack((xs, np.full_like(xs, top), xs, np.full_like(xs, bottom)))
+
+
+def bands(ys, left, width, height):
+    '''Return rectangles of the same width and height starting at every y'''
+    ys = np.asarray(ys, dtype=float)
+    return np.column_stack((np.full_like(ys, left), ys, np.full_like(ys, width), np.full_like(ys, height)))
+
+
+def squares(origin, size, counts):
+    '''Return rectangles of counts[0] x counts[1] squares row by row'''
+    rows, columns = np.mgrid[0:counts[1], 0:counts[0]]
+    return np.column_stack((origin[0] + size*columns.ravel(), origin[1] + size*rows.ravel(),
+                            np.full(rows.size, size, dtype=float), np.full(rows.size, size, dtype=float)))
+
+
+def circles(centers, radius):
+    '''Return circles of the same radius around every center'''
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    return np.column_stack((centers, np.full(len(centers), radius, dtype=float)))
+
+
+def diagonal_lines(field, margins, ystart, y_step, y_delta, dash_period=0):
+    '''Return segments of the parallel lines from (0, ypos) to (field[0], ypos - y_delta) clipped by the margins,
+    ypos = ystart + i*y_step'''
+    # Part of every line between the left and the right margins:
+    left = margins/field[0]
+    right = 1 - margins/field[0]
+    # Only lines with lowest <= ypos < highest cross the printable area:
+    lowest = margins + left*y_delta
+    highest = field[1] - margins + right*y_delta
+    first = max(0, math.ceil((lowest - ystart)/y_step))
+    last = math.floor((highest - ystart)/y_step)
+
+    ypos = ystart + y_step*np.arange(first, max(first, last + 1))
+    ypos = ypos[ypos < highest]
+    # Part of every line between the top and the bottom margins:
+    start = np.maximum(left, (ypos - field[1] + margins)/y_delta)
+    end = np.minimum(right, (ypos - margins)/y_delta)
+    if dash_period:
+        # Keep the dashes in place - cut every line by a whole number of periods:
+        length = math.hypot(field[0], y_delta)
+        start = np.floor(start*length/dash_period)*dash_period/length
+
+    return np.column_stack((start*field[0], ypos - start*y_delta, end*field[0], ypos - end*y_delta))
+
+
+def checkmates(origin, height, step, lower, upper, big_step, mark_width):
+    '''Return rectangles of the checkmates in the beginning of every line of writing from (origin, origin):
+    marks of the step height alternate between two columns from lower*step up to upper*step'''
+    ypos = periods(origin, height, big_step*step)
+
+    # Marks of one line of writing, the last one is short unless the height is a whole number of steps:
+    full = math.floor(lower - upper + 1e-9)
+    tops = lower*step - step*np.arange(1, full + 1)
+    heights = np.full(full, float(step))
+    if (lower - upper - full)*step > 1e-9:
+        tops = np.append(tops, upper*step)
+        heights = np.append(heights, (lower - upper - full)*step)
+    xs = origin + mark_width*((np.arange(len(tops)) + 1) % 2)
+
+    rows = len(ypos)
+    return np.column_stack((np.tile(xs, rows), (ypos[:, None] + tops[None, :]).ravel(),
+                            np.full(rows*len(tops), float(mark_width)), np.tile(heights, rows)))
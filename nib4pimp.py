@@ -1,42 +1,81 @@
+import io
 import os
 import sys
+import json
 import math
+import time
 import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import cairo
 
 import fonts
+import png_writer
+import profiler
+import svg_writer
+from display_list import DisplayList
 
 # TODO: Paper presets
 
-font_dict = {
-    "1": "Roman square capitals",
-    "2": "Antiqua Sans",
-    "3": "Blackletter",
-    "4": "Italic",
-    "5": "Copperplate",
-    "6": "Rustic",
-    "7": "Insular script, Uncial, Ustav",
-    "8": "Half-ustav",
-    "9": "Caroline minuscule"
-}
+# PNG images bigger than this are rendered by bands:
+max_surface_bytes = 256*1024*1024
+# Grid of the worker process rendering PNG bands:
+band_grid = None
+# Deflate level and row filter of PNG images:
+default_png_compression = (6, "UP")
 
-def main():
-    '''Get args from command line'''
+# Names of the fonts share the registry with their grid specifications:
+font_dict = {font: grid["name"] for font, grid in fonts.grids.items()}
+
+def section(text):
+    '''Parse FONT:NIB[:COUNT] section of the PDF document'''
+    parts = text.split(":")
+    try:
+        if len(parts) not in (2, 3):
+            raise ValueError(text)
+        return parts[0].strip(), float(parts[1]), int(parts[2]) if len(parts) == 3 else 1
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected FONT:NIB:COUNT, got '{}'".format(text))
+
+
+def compression(text):
+    '''Parse LEVEL[:FILTER] PNG compression'''
+    parts = text.split(":")
+    try:
+        if len(parts) not in (1, 2):
+            raise ValueError(text)
+        return int(parts[0]), parts[1].strip().upper() if len(parts) == 2 else default_png_compression[1]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected LEVEL[:FILTER], got '{}'".format(text))
+
+
+def filetypes(text):
+    '''Parse comma separated output filetypes, return them upper-cased without repeats and spaces'''
+    return ",".join(dict.fromkeys(filetype.strip().upper() for filetype in text.split(",")))
+
+
+def build_parser(exit_on_error=True, required=True, allow_abbrev=True):
+    '''Create the parser of the command line arguments'''
 # Parser description:
     parser = argparse.ArgumentParser(
         description="Let's create the grid!",
-        formatter_class=argparse.RawTextHelpFormatter
+        formatter_class=argparse.RawTextHelpFormatter,
+        exit_on_error=exit_on_error,
+        allow_abbrev=allow_abbrev
     )
-    parser.add_argument("-f", "--font", type=str, metavar="FONT", choices=sorted(font_dict.keys()), required=True,
+    parser.add_argument("-f", "--font", type=str, metavar="FONT", choices=sorted(font_dict.keys()),
         help="Font which you want generate a grid for. Accepted values:\n" +
             "\n".join(sorted([number + " - " + font_name for number, font_name in font_dict.items()])))
-    parser.add_argument("-n", "--nib-size", type=float, metavar="NUMBER", required=True,
+    parser.add_argument("-n", "--nib-size", type=float, metavar="NUMBER",
         help="Width of nib in millimeters. Accepted values:\n" +
              "0.2 ... 30")
-    parser.add_argument("-o", "--output-file", type=str, metavar="FILEPATH", required=True)
-    parser.add_argument("-t", "--type", type=str.upper, metavar="FILETYPE", choices=["PDF", "PNG", "SVG"], default="PDF",
+    parser.add_argument("-o", "--output-file", type=str, metavar="FILEPATH", required=required)
+    parser.add_argument("-t", "--type", type=filetypes, metavar="FILETYPE", default="PDF",
         help="Output filetype. Accepted values:\n" +
-             "PDF (default), PNG, SVG")
+             "PDF (default), PNG, SVG\n" +
+             "Several types separated by commas draw the grid once and write sibling files,\n" +
+             "e.g. -t PDF,SVG,PNG -o grid.pdf writes grid.pdf, grid.svg and grid.png")
     parser.add_argument("-x", "--x-paper", type=float, metavar="NUMBER", default=210,
         help="Paper width in millimeters. Accepted values:\n" +
              "100 ... 5000, default: 210")
@@ -49,70 +88,216 @@ def main():
     parser.add_argument("-r", "--resolution", type=int, metavar="NUMBER", default=300,
         help="DPI value for PNG/SVG images Accepted values:\n" +
              "1 ... 2400, default: 300")
-    args = parser.parse_args()
-
-# Argument checks:
-    error_flag = 0
-
-    try:
-        if os.path.isfile(args.output_file):
-            test_output = open(args.output_file, "r+")
-            test_output.close()
-        else:
-            test_output = open(args.output_file, "w")
-            test_output.close()
-            os.remove(args.output_file)
-    except:
-        print("[ERROR] Cannot write to the output file, check path existence or your write permissions")
-        error_flag = 1
-
-    if not 0.2 <= args.nib_size <= 30:
-        print("[ERROR] Wrong nib size")
-        error_flag = 1
+    parser.add_argument("-b", "--band-height", type=int, metavar="NUMBER",
+        help="Render PNG by horizontal bands of this height in pixels to limit the memory.\n" +
+             "Default: bands are used only for images bigger than {} MB".format(max_surface_bytes//1024//1024))
+    parser.add_argument("-p", "--processes", type=int, metavar="NUMBER", default=1,
+        help="Number of processes rendering PNG bands in parallel, default: 1")
+    parser.add_argument("-c", "--color-mode", type=str.upper, metavar="MODE", choices=["AUTO", "GRAY", "RGBA"], default="AUTO",
+        help="Pixel format of PNG images. Accepted values:\n" +
+             "AUTO (default) - GRAY if all grid colors are gray, RGBA otherwise\n" +
+             "GRAY - 8 bit grayscale on white, RGBA - 32 bit color on transparent background")
+    parser.add_argument("--preview", type=int, metavar="PIXELS",
+        help="Render the PNG thumbnail of about PIXELS pixels: the resolution is chosen to fit\n" +
+             "and details smaller than --lod-threshold are simplified or skipped")
+    parser.add_argument("--lod-threshold", type=float, metavar="PIXELS", default=1,
+        help="Smallest detail of the preview in pixels, default: 1")
+    parser.add_argument("--dots", action="store_true",
+        help="Draw dotted lines as lattices of dots instead of cairo dashes: one repeating pattern\n" +
+             "in PDF and SVG, in PNG the dots between two lines are filled once and repeated down the page\n" +
+             "(lines which aren't whole pixels apart are still dashed). Faster at high resolutions")
+    parser.add_argument("--png-compression", type=compression, metavar="LEVEL[:FILTER]",
+        default="{}:{}".format(*default_png_compression),
+        help="Deflate level 0 (fastest) ... 9 (smallest) and row filter of PNG images, rows are deflated\n" +
+             "by all CPUs. Filters: NONE, SUB, UP, AVERAGE, PAETH, ADAPTIVE (the best for every row),\n" +
+             "default: {}:{}".format(*default_png_compression))
+    parser.add_argument("-s", "--section", type=section, metavar="FONT:NIB:COUNT", action="append", dest="sections",
+        help="Add COUNT pages of the FONT grid for the NIB in millimeters to the PDF document.\n" +
+             "Repeat to make a booklet, e.g. -s 4:3:20 -s 3:3:10. Replaces --font and --nib-size")
+    parser.add_argument("--profile", type=str, metavar="FILEPATH",
+        help="Write the JSON report of the time of every phase (arguments, geometry, draw, encode)\n" +
+             "and of drawing calls of every grid element and cairo target, - writes to stdout")
+    parser.add_argument("--cprofile", type=str, metavar="FILEPATH",
+        help="Write cProfile statistics of the run readable by pstats, outputs are rendered one by one")
+
+    return parser
+
+
+def check_args(args):
+    '''Check command line argument values, return the list of errors'''
+    errors = []
+
+    # Several filetypes are written to sibling files, every one of them must be writable:
+    for output_args in split_types(args):
+        try:
+            if os.path.isfile(output_args.output_file):
+                test_output = open(output_args.output_file, "r+")
+                test_output.close()
+            else:
+                test_output = open(output_args.output_file, "w")
+                test_output.close()
+                os.remove(output_args.output_file)
+        except:
+            errors.append("Cannot write to the output file {}, check path existence or your write permissions".format(
+                output_args.output_file))
+
+    return errors + check_values(args)
+
+
+def check_values(args):
+    '''Check argument values except the output file, return the list of errors'''
+    errors = []
+
+    sections = getattr(args, "sections", None)
+    if sections:
+        if args.font is not None or args.nib_size is not None:
+            errors.append("Use either font and nib size or sections")
+        if args.type != "PDF":
+            errors.append("Sections are supported only for PDF")
+        for font, nib_size, count in sections:
+            if font not in font_dict or not 0.2 <= nib_size <= 30 or count < 1:
+                errors.append("Wrong section {}:{:g}:{}".format(font, nib_size, count))
+    else:
+        if args.font not in font_dict:
+            errors.append("Wrong font")
+        if args.nib_size is None or not 0.2 <= args.nib_size <= 30:
+            errors.append("Wrong nib size")
+        elif (args.font != "5" and not getattr(args, "preview", None) and args.type != "PDF" and
+              round(args.nib_size*args.resolution/25.4) < 1):
+            # The grid is measured in whole pixels, the nib would take none of them:
+            errors.append("Nib is smaller than a pixel at this resolution")
+    if any(filetype not in ["PDF", "PNG", "SVG"] for filetype in args.type.split(",")):
+        errors.append("Wrong output filetype")
     if (not 100 <= args.x_paper <= 5000) or (not 100 <= args.y_paper <= 5000):
-        print("[ERROR] Wrong paper size")
-        error_flag = 1
+        errors.append("Wrong paper size")
 
     if (not 5 <= args.margins <= 30):
-        print("[ERROR] Wrong margin size")
-        error_flag = 1
+        errors.append("Wrong margin size")
 
     if (not 1 <= args.resolution <= 2400):
-        print("[ERROR] Wrong print resolution")
-        error_flag = 1
-
-    if error_flag != 0:
-        sys.exit(1)
+        errors.append("Wrong print resolution")
+
+    if getattr(args, "band_height", None) is not None and args.band_height < 1:
+        errors.append("Wrong band height")
+    if getattr(args, "processes", 1) < 1:
+        errors.append("Wrong number of processes")
+    if getattr(args, "color_mode", "AUTO") not in ["AUTO", "GRAY", "RGBA"]:
+        errors.append("Wrong color mode")
+    if getattr(args, "preview", None) is not None:
+        if args.preview < 1:
+            errors.append("Wrong preview size")
+        if args.type != "PNG":
+            errors.append("Preview is supported only for PNG")
+    if getattr(args, "lod_threshold", 1) < 0:
+        errors.append("Wrong level of detail threshold")
+    level, png_filter = getattr(args, "png_compression", default_png_compression)
+    if not 0 <= level <= 9 or png_filter not in png_writer.filters:
+        errors.append("Wrong PNG compression")
+
+    return errors
+
+
+def adjust_args(args):
+    '''Apply font and filetype specific rules to arguments, return the list of info messages'''
+    messages = []
 
     # Ignore the nib size user decision if copperplate chosen:
     if args.font == "5":
         args.nib_size = 8.75
-        print("[INFO] Nib size is ignored for copperplate grid")
+        messages.append("Nib size is ignored for copperplate grid")
+    if getattr(args, "sections", None):
+        if any(font == "5" for font, nib_size, count in args.sections):
+            messages.append("Nib size is ignored for copperplate grid")
+        args.sections = [(font, 8.75 if font == "5" else nib_size, count) for font, nib_size, count in args.sections]
 
     # Do not add margins if output format differs from PDF:
     if args.type != "PDF":
         if args.margins != 15:
-            print("[INFO] Margins aren't used in formats other than PDF")
+            messages.append("Margins aren't used in formats other than PDF")
         args.margins = 0
 
+    # Fit the preview into its pixel budget:
+    if getattr(args, "preview", None):
+        args.resolution = max(1, min(2400, math.floor(25.4*math.sqrt(args.preview/(args.x_paper*args.y_paper)))))
+        messages.append("Preview resolution is {} DPI".format(args.resolution))
+
+    # 8 bit grayscale PNG is enough for the gray palette:
+    if getattr(args, "color_mode", "AUTO") == "AUTO":
+        args.color_mode = "GRAY" if gray_palette() else "RGBA"
+
+    return messages
+
+
+def gray_palette():
+    '''Check if all colors of the grids are opaque grays'''
+    return all(color[0] == color[1] == color[2] and color[3] == 1
+               for color in (fonts.main_line, fonts.aux_line, fonts.bg_color))
+
+
+def main():
+    '''Get args from command line'''
+    parser = build_parser()
+    args = parser.parse_args()
+    if not args.sections and (args.font is None or args.nib_size is None):
+        parser.error("the following arguments are required: -f/--font, -n/--nib-size")
+
+# Argument checks:
+    errors = check_args(args)
+    for error in errors:
+        print("[ERROR] " + error)
+    if errors:
+        sys.exit(1)
+
+    outputs = split_types(args)
+    messages = []
+    for output_args in outputs:
+        messages += [message for message in adjust_args(output_args) if message not in messages]
+    for message in messages:
+        print("[INFO] " + message)
+
     # Preserve the nib size to show it in the info string:
     global nib_mm
-    nib_mm = args.nib_size
+    nib_mm = outputs[0].nib_size
+
+    return outputs
+
 
-    return args
+def split_types(args):
+    '''Return arguments for every output filetype, several types are written to sibling files'''
+    # Types are normalised by filetypes() when parsed:
+    types = args.type.split(",")
+    if len(types) == 1:
+        return [args]
+
+    base = os.path.splitext(args.output_file)[0] if isinstance(args.output_file, str) else None
+    outputs = []
+    for filetype in types:
+        output_args = argparse.Namespace(**vars(args))
+        output_args.type = filetype
+        if base is not None:
+            output_args.output_file = base + "." + filetype.lower()
+        outputs.append(output_args)
+
+    return outputs
 
 
 def prepare(raw_args):
     '''Transform values from millimeters to proper dimensions'''
     if raw_args.type == "PDF":
         # Computer points
-        raw_args.nib_size = round(raw_args.nib_size/0.3527)
+        raw_args.nib_size = round(raw_args.nib_size/0.3527) if raw_args.nib_size is not None else None
         raw_args.x_paper = round(raw_args.x_paper/0.3527)
         raw_args.y_paper = round(raw_args.y_paper/0.3527)
         raw_args.margins = round(raw_args.margins/0.3527)
+        # Sections keep the nib in millimeters for the info string:
+        if getattr(raw_args, "sections", None):
+            raw_args.sections = [(font, nib_mm, round(nib_mm/0.3527), count) for font, nib_mm, count in raw_args.sections]
     else:
         # Pixels
         raw_args.nib_size = round(raw_args.nib_size*raw_args.resolution/25.4)
+        # Low preview resolutions keep the nib at one pixel at least, finer details are simplified anyway:
+        if getattr(raw_args, "preview", None):
+            raw_args.nib_size = max(1, raw_args.nib_size)
         raw_args.x_paper = round(raw_args.x_paper*raw_args.resolution/25.4)
         raw_args.y_paper = round(raw_args.y_paper*raw_args.resolution/25.4)
         raw_args.margins = round(raw_args.margins*raw_args.resolution/25.4)
@@ -120,70 +305,78 @@ def prepare(raw_args):
     return raw_args
 
 
-def create_surface(paper_size, filetype, output):
+def create_surface(paper_size, filetype, output, gray=False):
     '''Create proper surface based on chosen output file format'''
     if filetype == "PDF":
         surface = cairo.PDFSurface(output, *paper_size)
     elif filetype == "PNG":
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *paper_size)
+        surface = cairo.ImageSurface(cairo.FORMAT_A8 if gray else cairo.FORMAT_ARGB32, *paper_size)
     else:
         surface = cairo.SVGSurface(output, *paper_size)
 
     context = cairo.Context(surface)
+    if filetype == "PNG" and gray:
+        # Alpha of A8 image is saved as the gray level, start from white:
+        context.set_source_rgba(0, 0, 0, 1)
+        context.paint()
 
     return surface, context
 
 
-def draw_grid(surface, context, font, nib_size, field, margins):
-    '''Choose proper draw function based on chosen font'''
-    context.save()
+def grid_options(args):
+    '''Return build_grid() options for prepared arguments: the smallest size of drawn primitives and dots'''
+    return {"min_size": args.lod_threshold if getattr(args, "preview", None) else 0,
+            "dots": bool(getattr(args, "dots", False))}
 
-    if font == "1":
-        surface, context = fonts.roman_square_capitals(surface, context, nib_size, field, margins)
-    elif font == "2":
-        surface, context = fonts.antiqua_sans(surface, context, nib_size, field, margins)
-    elif font == "3":
-        surface, context = fonts.blackletter(surface, context, nib_size, field, margins)
-    elif font == "4":
-        surface, context = fonts.italic(surface, context, nib_size, field, margins)
-    elif font == "5":
-        surface, context = fonts.copperplate(surface, context, nib_size, field, margins)
-    elif font == "6":
-        # Rustic
-        surface, context = fonts.rustic_ustav_minuscule(surface, context, nib_size, field, margins, 6)
-    elif font == "7":
-        # Ustav
-        surface, context = fonts.rustic_ustav_minuscule(surface, context, nib_size, field, margins, 5)
-    elif font == "8":
-        # Half-ustav
-        surface, context = fonts.rustic_ustav_minuscule(surface, context, nib_size, field, margins, 4)
-    elif font == "9":
-        # Minuscule
-        surface, context = fonts.rustic_ustav_minuscule(surface, context, nib_size, field, margins, 3)
-    else:
-        sys.exit()
 
-    context.restore()
+def build_grid(font, nib_size, field, margins, min_size=0, dots=False, profile=None):
+    '''Return the display list of the grid, the same display list is returned for the same arguments
+    and must not be changed. Profiled grids are compiled again to time and count their generators'''
+    if profile is None:
+        return cached_grid(font, nib_size, field, margins, min_size, dots)
+
+    with profile.phase("geometry"):
+        return compile_grid(font, nib_size, field, margins, min_size, dots, profile.counting)
+
+
+@functools.lru_cache(maxsize=32)
+def cached_grid(font, nib_size, field, margins, min_size=0, dots=False):
+    '''Memoised compile_grid()'''
+    return compile_grid(font, nib_size, field, margins, min_size, dots)
 
-    return surface, context
 
+def compile_grid(font, nib_size, field, margins, min_size=0, dots=False, counting=None):
+    '''Compile the grid specification of the font, return the display list of the grid'''
+    # Generators don't need the surface to draw on the display list:
+    surface, display_list = fonts.draw(None, DisplayList(min_size, dots), fonts.grids[font], nib_size, field, margins,
+                                       counting)
 
-def draw_margins(surface, context, field, margins):
-    '''Draw margins for PDF documents'''
+    return display_list
+
+
+def draw_grid(surface, context, font, nib_size, field, margins, display_list=None, profile=None):
+    '''Draw the grid for chosen font'''
     context.save()
 
-    context.set_fill_rule(cairo.FILL_RULE_EVEN_ODD)
-    context.set_source_rgba(1, 1, 1, 1)
-    context.rectangle(0 + margins, 0 + margins, field[0] - 2*margins, field[1] - 2*margins)
-    context.rectangle(0, 0, field[0], field[1])
-    context.stroke_preserve()
-    context.fill()
+    # Generators draw on the display list, which is painted layer by layer at the end:
+    if display_list is None:
+        display_list = build_grid(font, nib_size, field, margins, profile=profile)
+    context = display_list.flush(context)
 
     context.restore()
 
     return surface, context
 
 
+def clip_margins(surface, context, field, margins):
+    '''Limit drawing to the printable area of PDF documents, restore the context to remove the clip'''
+    # The grid used to be covered by the white frame stroked 2 units wide, so 1 unit more is hidden:
+    context.rectangle(margins + 1, margins + 1, field[0] - 2*margins - 2, field[1] - 2*margins - 2)
+    context.clip()
+
+    return surface, context
+
+
 def write_info(surface, context, font, nib_size, margins):
     '''Write the information about chosen grid and nib'''
     context.save()
@@ -200,20 +393,266 @@ def write_info(surface, context, font, nib_size, margins):
     return surface, context
 
 
-def save_result(surface, context, filetype, output):
+def save_result(surface, context, filetype, output, png_compression=default_png_compression):
     '''Choose proper save function based on chosen output file format'''
     if filetype in ["PDF", "SVG"]:
         context.show_page()
     else:
-        surface.write_to_png(output)
+        # Threads deflate rows read straight from the surface buffer:
+        png_writer.write_surface(output, surface, *png_compression, threads=os.cpu_count())
+
+
+def draw_band(display_list, width, top, height, gray=False, profile=None):
+    '''Draw the band of PNG grid, return its image surface'''
+    with profiler.phase(profile, "draw"):
+        surface, context = create_surface((width, height), "PNG", None, gray)
+        context = profiler.counting(profile, context, "cairo PNG")
+        context.translate(0, -top)
+        context = display_list.flush(context)
+
+    return surface
+
+
+def render_band(display_list, width, top, height, gray=False, png_compression=default_png_compression):
+    '''Draw the band of PNG grid, return it as the list of deflated pieces of the image stream,
+    (data, Adler-32, length, rows) each'''
+    surface = draw_band(display_list, width, top, height, gray)
+    rows, color_type = png_writer.surface_rows(surface)
+    # Temporaries of filtering stay as small as in PNGStream.write_surface(), chunks are filtered against
+    # the row before them, the previous band isn't known here, its first row is filtered without it:
+    step = max(1, png_writer.deflate_chunk_size//(width*png_writer.pixel_sizes[color_type]))
+    pieces = [png_writer.encode_rows(rows[start:start + step], color_type, *png_compression,
+                                     prior=rows[start - 1] if start else None) + (len(rows[start:start + step]),)
+              for start in range(0, len(rows), step)]
+    surface.finish()
+
+    return pieces
+
+
+def init_band_worker(display_list):
+    '''Keep the grid in every worker process'''
+    global band_grid
+    band_grid = display_list
+
+
+def render_band_worker(band):
+    '''Draw the band of PNG grid in the worker process'''
+    return render_band(band_grid, *band)
+
+
+def render_bands(args, band_height, processes=1, display_list=None, profile=None):
+    '''Draw PNG grid band by band streaming rows into the output file'''
+    field = (args.x_paper, args.y_paper)
+    if display_list is None:
+        display_list = build_grid(args.font, args.nib_size, field, args.margins, profile=profile,
+                                  **grid_options(args))
+    gray = args.color_mode == "GRAY"
+    level, png_filter = getattr(args, "png_compression", default_png_compression)
+    bands = [(args.x_paper, top, min(band_height, args.y_paper - top), gray, (level, png_filter))
+             for top in range(0, args.y_paper, band_height)]
+
+    output = open(args.output_file, "wb") if isinstance(args.output_file, str) else args.output_file
+    try:
+        stream = png_writer.PNGStream(output, args.x_paper, args.y_paper, 0 if gray else 6, level,
+                                      png_filter=png_filter, threads=os.cpu_count())
+        if processes > 1:
+            # Worker processes draw and encode bands, their calls aren't counted:
+            with profiler.phase(profile, "bands"):
+                with multiprocessing.Pool(processes, init_band_worker, (display_list,)) as pool:
+                    for pieces in pool.imap(render_band_worker, bands):
+                        for piece in pieces:
+                            stream.write_deflated(*piece)
+        else:
+            for band in bands:
+                surface = draw_band(display_list, *band[:4], profile=profile)
+                with profiler.phase(profile, "encode"):
+                    stream.write_surface(surface)
+                    surface.finish()
+        with profiler.phase(profile, "encode"):
+            stream.close()
+    finally:
+        if output is not args.output_file:
+            output.close()
+
+
+def render_document(args, profile=None):
+    '''Draw PDF pages of all sections, every distinct grid is recorded once and replayed on its pages'''
+    field = (args.x_paper, args.y_paper)
+    surface = cairo.PDFSurface(args.output_file, *field)
+    context = profiler.counting(profile, cairo.Context(surface), "cairo PDF")
+
+    pages = {}
+    for font, nib_mm, nib_size, count in args.sections:
+        if (font, nib_size) not in pages:
+            page = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, *field))
+            page_context = profiler.counting(profile, cairo.Context(page), "cairo PDF")
+            page, page_context = clip_margins(page, page_context, field, args.margins)
+            display_list = build_grid(font, nib_size, field, args.margins, profile=profile)
+            with profiler.phase(profile, "draw"):
+                page, page_context = draw_grid(page, page_context, font, nib_size, field, args.margins, display_list)
+            pages[(font, nib_size)] = page
+
+        # PDF surface writes the same recording surface once and refers to it from every page:
+        with profiler.phase(profile, "draw"):
+            for number in range(count):
+                context.set_source_surface(pages[(font, nib_size)])
+                context.paint()
+                surface, context = write_info(surface, context, font, nib_mm, args.margins)
+                context.show_page()
+
+    with profiler.phase(profile, "encode"):
+        surface.finish()
+
+
+def render(args, nib_mm, band_height=None, processes=1, display_list=None, profile=None):
+    '''Draw the grid for prepared arguments and save it to the output file'''
+    if getattr(args, "sections", None):
+        return render_document(args, profile)
+    if display_list is None:
+        display_list = build_grid(args.font, args.nib_size, (args.x_paper, args.y_paper), args.margins,
+                                  profile=profile, **grid_options(args))
+
+    gray = args.type == "PNG" and args.color_mode == "GRAY"
+    if args.type == "PNG":
+        # Split big images into bands to limit the memory:
+        pixel_size = 1 if gray else 4
+        if band_height is None and args.x_paper*args.y_paper*pixel_size > max_surface_bytes:
+            band_height = max(1, max_surface_bytes//(args.x_paper*pixel_size))
+        # Give every process a few bands to balance the load:
+        if band_height is None and processes > 1:
+            band_height = max(1, math.ceil(args.y_paper/(4*processes)))
+        if band_height is not None and band_height < args.y_paper:
+            return render_bands(args, band_height, processes, display_list, profile)
+    elif args.type == "SVG":
+        # Cairo expands every primitive, the own writer lets the viewer repeat the tiles:
+        with profiler.phase(profile, "encode"):
+            return svg_writer.write_svg(args.output_file, display_list, args.x_paper, args.y_paper)
+
+    with profiler.phase(profile, "draw"):
+        surface, context = create_surface((args.x_paper, args.y_paper), args.type, args.output_file, gray)
+        context = profiler.counting(profile, context, "cairo " + args.type)
+        context.save()
+        if args.type == "PDF":
+            surface, context = clip_margins(surface, context, (args.x_paper, args.y_paper), args.margins)
+        surface, context = draw_grid(surface, context, args.font, args.nib_size, (args.x_paper, args.y_paper),
+                                     args.margins, display_list)
+        context.restore()
+        if args.type == "PDF":
+            surface, context = write_info(surface, context, args.font, nib_mm, args.margins)
+    with profiler.phase(profile, "encode"):
+        save_result(surface, context, args.type, args.output_file,
+                    getattr(args, "png_compression", default_png_compression))
+        surface.finish()
+
+
+def render_all(outputs, nib_mm, band_height=None, processes=1, profile=None):
+    '''Draw the grid once for every distinct geometry and replay it to all outputs in parallel'''
+    # PDF is measured in points and PNG/SVG in pixels, outputs share the grid only with the same dimensions:
+    grids = {}
+    for args in outputs:
+        geometry = (args.font, args.nib_size, args.x_paper, args.y_paper, args.margins,
+                    tuple(grid_options(args).items()))
+        if geometry not in grids and not getattr(args, "sections", None):
+            grids[geometry] = build_grid(args.font, args.nib_size, (args.x_paper, args.y_paper), args.margins,
+                                         profile=profile, **grid_options(args))
+    displays = [grids.get((args.font, args.nib_size, args.x_paper, args.y_paper, args.margins,
+                           tuple(grid_options(args).items()))) for args in outputs]
+
+    # cProfile follows only its own thread:
+    if profile is not None and profile.python is not None:
+        for args, display_list in zip(outputs, displays):
+            render(args, nib_mm, band_height, processes, display_list, profile)
+        return
+
+    # Processes rendering PNG bands are forked before any thread starts,
+    # a fork while another thread holds a lock inside cairo or zlib can deadlock the child:
+    threaded = []
+    for args, display_list in zip(outputs, displays):
+        if args.type == "PNG" and processes > 1:
+            render(args, nib_mm, band_height, processes, display_list, profile)
+        else:
+            threaded.append((args, display_list))
+    if not threaded:
+        return
+
+    # Cairo releases GIL while it draws, so threads replay the grid concurrently:
+    with ThreadPoolExecutor(max_workers=len(threaded)) as pool:
+        futures = [pool.submit(render, args, nib_mm, band_height, processes, display_list, profile)
+                   for args, display_list in threaded]
+        for future in futures:
+            future.result()
+
+
+def profile_report(outputs, nib_mm, profile):
+    '''Return the JSON-ready report of the profiled job with its grid parameters'''
+    return dict({"font": outputs[0].font, "nib_size": nib_mm,
+                 "outputs": [{"type": args.type, "size": [args.x_paper, args.y_paper],
+                              "resolution": None if args.type == "PDF" else args.resolution} for args in outputs]},
+                **profile.report())
+
+
+def write_profile(outputs, nib_mm, profile):
+    '''Write the report and cProfile statistics of the profiled job where the arguments ask for them'''
+    if outputs[0].profile == "-":
+        print(json.dumps(profile_report(outputs, nib_mm, profile), indent=1))
+    elif outputs[0].profile:
+        with open(outputs[0].profile, "w") as report:
+            json.dump(profile_report(outputs, nib_mm, profile), report, indent=1)
+    if outputs[0].cprofile:
+        profile.dump_python(outputs[0].cprofile)
+
+
+def grid_args(font, nib_mm, paper_mm=(210, 297), margins_mm=15, fmt="PDF", dpi=300, color_mode="AUTO",
+              preview=None, lod_threshold=1, dots=False, png_compression=default_png_compression):
+    '''Check and prepare arguments of render_grid(), return (args, nib_mm),
+    PNG compression is LEVEL[:FILTER] text or (level, filter)'''
+    if "," in str(fmt):
+        raise ValueError("One filetype per grid")
+    if isinstance(png_compression, str):
+        try:
+            png_compression = compression(png_compression)
+        except argparse.ArgumentTypeError as error:
+            raise ValueError(str(error))
+    args = argparse.Namespace(font=str(font), nib_size=float(nib_mm), output_file=None, type=str(fmt).strip().upper(),
+                              x_paper=float(paper_mm[0]), y_paper=float(paper_mm[1]), margins=int(margins_mm),
+                              resolution=int(dpi), color_mode=str(color_mode).upper(),
+                              preview=None if preview is None else int(preview), lod_threshold=float(lod_threshold),
+                              dots=bool(dots),
+                              png_compression=(int(png_compression[0]), str(png_compression[1]).upper()))
+    errors = check_values(args)
+    if errors:
+        raise ValueError("; ".join(errors))
+    adjust_args(args)
+    nib_mm = args.nib_size
+
+    return prepare(args), nib_mm
+
+
+def render_grid(font, nib_mm, paper_mm=(210, 297), margins_mm=15, fmt="PDF", dpi=300, output=None,
+                band_height=None, processes=1, color_mode="AUTO", preview=None, lod_threshold=1, dots=False,
+                png_compression=default_png_compression, profile=None):
+    '''Render the grid in memory: return bytes or write them into the file-like output,
+    profiler.Profile collects the time of phases and drawing calls'''
+    with profiler.phase(profile, "arguments"):
+        args, nib_mm = grid_args(font, nib_mm, paper_mm, margins_mm, fmt, dpi, color_mode, preview, lod_threshold,
+                                 dots, png_compression)
+    args.output_file = io.BytesIO() if output is None else output
+    render(args, nib_mm, band_height, processes, profile=profile)
+
+    if output is None:
+        return args.output_file.getvalue()
 
 
 if __name__ == "__main__":
-    raw_args = main()
-    args = prepare(raw_args)
-    surface, context = create_surface((args.x_paper, args.y_paper), args.type, args.output_file)
-    surface, context = draw_grid(surface, context, args.font, args.nib_size, (args.x_paper, args.y_paper), args.margins)
-    if args.type == "PDF":
-        surface, context = draw_margins(surface, context, (args.x_paper, args.y_paper), args.margins)
-        surface, context = write_info(surface, context, args.font, nib_mm, args.margins)
-    save_result(surface, context, args.type, args.output_file)
\ No newline at end of file
+    start = time.perf_counter()
+    outputs = [prepare(raw_args) for raw_args in main()]
+
+    profile = None
+    if outputs[0].profile or outputs[0].cprofile:
+        profile = profiler.Profile(python=bool(outputs[0].cprofile))
+        profile.add("arguments", time.perf_counter() - start)
+        profile.start()
+    render_all(outputs, nib_mm, outputs[0].band_height, outputs[0].processes, profile)
+    if profile is not None:
+        profile.stop()
+        write_profile(outputs, nib_mm, profile)
@@ -0,0 +1,193 @@
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import cairo
+import numpy as np
+
+signature = b"\x89PNG\r\n\x1a\n"
+
+# Bytes per pixel of 8 bit color types:
+pixel_sizes = {0: 1, 2: 3, 4: 2, 6: 4}
+
+# Row filters by their names, ADAPTIVE takes the best one for every row as libpng does:
+filters = {"NONE": 0, "SUB": 1, "UP": 2, "AVERAGE": 3, "PAETH": 4, "ADAPTIVE": None}
+
+# Raw bytes of rows deflated by one thread at once:
+deflate_chunk_size = 4*1024*1024
+
+
+def png_chunk(chunk_type, data):
+    '''Pack the PNG chunk'''
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def adler32_combine(adler1, adler2, length2):
+    '''Return Adler-32 of the joined data from Adler-32 of both parts as zlib adler32_combine() does'''
+    base = 65521
+    remainder = length2 % base
+    sum1 = (adler1 & 0xffff) + (adler2 & 0xffff) + base - 1
+    sum2 = remainder*(adler1 & 0xffff) + (adler1 >> 16) + (adler2 >> 16) + base - remainder
+    return sum1 % base | (sum2 % base) << 16
+
+
+def surface_rows(surface):
+    '''Return (rows, color type) of the cairo image surface, rows view its buffer without copying:
+    bytes of A8 saved as gray, native 32 bit words of ARGB32 saved as RGBA'''
+    surface.flush()
+    width, height, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+    if surface.get_format() == cairo.FORMAT_A8:
+        return np.frombuffer(surface.get_data(), np.uint8).reshape(height, stride)[:, :width], 0
+    if surface.get_format() == cairo.FORMAT_ARGB32:
+        return np.frombuffer(surface.get_data(), np.uint32).reshape(height, stride//4)[:, :width], 6
+    raise ValueError("Unsupported surface format")
+
+
+def png_pixels(rows, color_type):
+    '''Return PNG pixel bytes of the surface rows, cairo premultiplies colors by alpha'''
+    if color_type == 0:
+        return rows
+
+    alpha = rows >> 24
+    pixels = np.empty(rows.shape + (4,), np.uint8)
+    pixels[..., 3] = alpha
+    for channel, shift in enumerate((16, 8, 0)):
+        value = rows >> shift & 0xff
+        # Rounded as cairo unpremultiplies, transparent pixels are black:
+        pixels[..., channel] = np.where(alpha, (value*255 + alpha//2)//np.maximum(alpha, 1), 0)
+
+    return pixels.reshape(len(rows), -1)
+
+
+def filter_rows(pixels, pixel_size, png_filter, prior=None):
+    '''Return rows of the filter type byte and the filtered pixel bytes, prior is the raw row before the first one.
+    Without the prior the first row is filtered only by NONE or SUB which don't refer to it'''
+    current = pixels.astype(np.int16)
+    above = np.empty_like(current)
+    above[0] = 0 if prior is None else prior
+    above[1:] = current[:-1]
+    left = np.zeros_like(current)
+    left[:, pixel_size:] = current[:, :-pixel_size]
+    up_left = np.zeros_like(current)
+    up_left[:, pixel_size:] = above[:, :-pixel_size]
+
+    def paeth():
+        estimate = left + above - up_left
+        distance_left, distance_up, distance_up_left = (np.abs(estimate - left), np.abs(estimate - above),
+                                                        np.abs(estimate - up_left))
+        return np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                        np.where(distance_up <= distance_up_left, above, up_left))
+
+    predictors = {0: lambda: 0, 1: lambda: left, 2: lambda: above, 3: lambda: (left + above) >> 1, 4: paeth}
+    filtered = np.empty((len(current), current.shape[1] + 1), np.uint8)
+    if filters[png_filter] is None:
+        candidates = np.stack([(current - predictors[kind]()).astype(np.uint8) for kind in range(5)])
+        # Every row takes the filter with the smallest sum of its bytes taken as signed:
+        scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+        if prior is None:
+            scores[2:, 0] = np.iinfo(np.int32).max
+        kinds = scores.argmin(axis=0)
+        filtered[:, 1:] = candidates[kinds, np.arange(len(current))]
+    else:
+        kinds = np.full(len(current), filters[png_filter])
+        filtered[:, 1:] = (current - predictors[kinds[0]]()).astype(np.uint8)
+        if prior is None and kinds[0] > 1:
+            kinds[0] = 1
+            filtered[0, 1:] = (current[0] - left[0]).astype(np.uint8)
+    filtered[:, 0] = kinds
+
+    return filtered
+
+
+def encode_rows(rows, color_type, level=6, png_filter="UP", prior=None):
+    '''Filter and deflate the surface rows, return (raw deflate data, Adler-32, length) of the piece of
+    the zlib stream ending at the byte boundary, prior is the surface row before the first one'''
+    pixels = png_pixels(rows, color_type)
+    if prior is not None:
+        prior = png_pixels(prior[None], color_type)[0]
+    filtered = filter_rows(pixels, pixel_sizes[color_type], png_filter, prior).tobytes()
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(filtered) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    return data, zlib.adler32(filtered), len(filtered)
+
+
+class PNGStream:
+    '''PNG encoder which takes the image by horizontal bands and writes it into the file-like output.
+    Pieces of the zlib stream are deflated separately and joined, so threads and processes deflate them in parallel'''
+
+    def __init__(self, output, width, height, color_type, level=6, chunk_size=1024*1024, png_filter="UP", threads=1):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.color_type = color_type
+        self.level = level
+        self.chunk_size = chunk_size
+        self.png_filter = png_filter
+        self.threads = threads
+        # The zlib header, Adler-32 of the data deflated so far and the last surface row:
+        self.pending = [zlib.compress(b"", level)[:2]]
+        self.pending_size = 2
+        self.adler = zlib.adler32(b"")
+        self.prior = None
+        self.rows = 0
+
+        self.output.write(signature)
+        self.output.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+
+    def write_deflated(self, data, adler, length, rows):
+        '''Append the piece of the stream returned by encode_rows()'''
+        self.pending.append(data)
+        self.pending_size += len(data)
+        self.adler = adler32_combine(self.adler, adler, length)
+        if self.pending_size >= self.chunk_size:
+            self.write_idat()
+        self.rows += rows
+        self.prior = None
+
+    def write_surface(self, surface):
+        '''Append rows of the image surface, threads encode them by chunks,
+        the first row is filtered against the last row of the previous surface'''
+        rows, color_type = surface_rows(surface)
+        if surface.get_width() != self.width or color_type != self.color_type:
+            raise ValueError("Surface differs from the image")
+
+        step = max(1, deflate_chunk_size//(self.width*pixel_sizes[color_type]))
+        chunks = [(rows[start:start + step], rows[start - 1] if start else self.prior)
+                  for start in range(0, len(rows), step)]
+        prior = rows[-1].copy() if len(rows) else self.prior
+        with ThreadPoolExecutor(max_workers=max(1, min(self.threads, len(chunks)))) as pool:
+            pieces = pool.map(lambda chunk: encode_rows(chunk[0], color_type, self.level, self.png_filter, chunk[1]),
+                              chunks)
+            for chunk, piece in zip(chunks, pieces):
+                self.write_deflated(*piece, len(chunk[0]))
+        self.prior = prior
+
+    def write_idat(self):
+        '''Write compressed data collected so far as the IDAT chunk'''
+        if self.pending_size:
+            self.output.write(png_chunk(b"IDAT", b"".join(self.pending)))
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        '''Finish the image'''
+        if self.rows != self.height:
+            raise ValueError("Wrong number of rows: {} instead of {}".format(self.rows, self.height))
+        # The empty final block and Adler-32 end the zlib stream:
+        self.pending.append(b"\x03\x00" + struct.pack(">I", self.adler))
+        self.pending_size += 6
+        self.write_idat()
+        self.output.write(png_chunk(b"IEND", b""))
+
+
+def write_surface(output, surface, level=6, png_filter="UP", threads=1):
+    '''Write the image surface as PNG into the file path or the file-like output'''
+    if isinstance(output, str):
+        with open(output, "wb") as png:
+            return write_surface(png, surface, level, png_filter, threads)
+
+    stream = PNGStream(output, surface.get_width(), surface.get_height(), surface_rows(surface)[1], level,
+                       png_filter=png_filter, threads=threads)
+    stream.write_surface(surface)
+    stream.close()
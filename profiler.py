@@ -0,0 +1,109 @@
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+
+# Drawing calls counted by the proxy, calls with arrays count every primitive of the array:
+counted_calls = ["move_to", "line_to", "rectangle", "arc", "stroke", "fill", "paint",
+                 "lines", "rectangles", "circles", "tile", "dot_lattice"]
+array_calls = ["lines", "rectangles", "circles"]
+
+
+class CountingContext:
+    '''Proxy of the cairo context or the display list which counts drawing calls into the dict'''
+
+    def __init__(self, context, counters):
+        self.context = context
+        self.counters = counters
+
+    def __getattr__(self, name):
+        attribute = getattr(self.context, name)
+        if name not in counted_calls:
+            return attribute
+
+        def counted(*args):
+            self.counters[name] = self.counters.get(name, 0) + (len(args[0]) if name in array_calls else 1)
+            return attribute(*args)
+        return counted
+
+    def cell(self):
+        '''Return the counting proxy of the new cell, cells count as their generator'''
+        return CountingContext(self.context.cell(), self.counters)
+
+    def tile(self, cell, *args):
+        self.counters["tile"] = self.counters.get("tile", 0) + 1
+        return self.context.tile(cell.context if isinstance(cell, CountingContext) else cell, *args)
+
+
+class Profile:
+    '''Wall time of the pipeline phases and counts of drawing calls of one job, threads of the job share it
+
+    Phases running in parallel threads add their times up. With python set the calling
+    thread is profiled by cProfile as well, outputs are rendered one by one then.'''
+
+    def __init__(self, python=False):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+        self.python = cProfile.Profile() if python else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Time the block as the part of the phase'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        '''Add the time of the phase measured elsewhere'''
+        with self.lock:
+            phase = self.phases.setdefault(name, {"seconds": 0, "calls": 0})
+            phase["seconds"] += seconds
+            phase["calls"] += 1
+
+    def counter(self, name):
+        '''Return the dict of counters of the generator or the target'''
+        with self.lock:
+            return self.counters.setdefault(name, {})
+
+    def count(self, name, key, number=1):
+        '''Add the number to the counter'''
+        counters = self.counter(name)
+        with self.lock:
+            counters[key] = counters.get(key, 0) + number
+
+    def counting(self, context, name):
+        '''Wrap the context into the proxy counting its drawing calls under the name'''
+        return CountingContext(context, self.counter(name))
+
+    def start(self):
+        if self.python is not None:
+            self.python.enable()
+
+    def stop(self):
+        if self.python is not None:
+            self.python.disable()
+
+    def report(self):
+        '''Return the JSON-ready report'''
+        with self.lock:
+            return {"seconds": sum(phase["seconds"] for phase in self.phases.values()),
+                    "phases": {name: dict(phase) for name, phase in self.phases.items()},
+                    "counters": {name: dict(counters) for name, counters in self.counters.items()}}
+
+    def dump_python(self, path):
+        '''Write cProfile statistics readable by pstats'''
+        pstats.Stats(self.python).dump_stats(path)
+
+
+def phase(profile, name):
+    '''Time the block as the phase of the profile, do nothing without the profile'''
+    return contextlib.nullcontext() if profile is None else profile.phase(name)
+
+
+def counting(profile, context, name):
+    '''Wrap the context into the counting proxy of the profile, return it unchanged without the profile'''
+    return context if profile is None else profile.counting(context, name)
@@ -0,0 +1,302 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import collections
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ProcessPoolExecutor
+
+import batch
+import nib4pimp
+from cache import RenderCache, grid_key
+
+# Query fields named differently from the long options of nib4pimp.py:
+aliases = {"nib": "nib-size"}
+# Fields which would write files on the server, start processes of its own or choose its memory:
+forbidden_fields = ["output-file", "profile", "cprofile", "processes", "band-height", "help"]
+# Fields of the query are the remaining long options of nib4pimp.py, nothing else reaches its parser:
+allowed_fields = [option[2:] for action in nib4pimp.build_parser()._actions for option in action.option_strings
+                  if option.startswith("--") and option[2:] not in forbidden_fields]
+# Biggest image rendered, A4 at 1200 DPI fits:
+max_pixels = 160*1000*1000
+content_types = {"PDF": "application/pdf", "PNG": "image/png", "SVG": "image/svg+xml"}
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+# Bodies are written by parts of this size waiting for the client to take them:
+write_size = 64*1024
+# Percentiles of the latency are taken over this many last requests:
+latency_window = 1000
+# Throughput is also measured over this many last seconds:
+recent_seconds = 60
+
+
+def main():
+    '''Get args from command line'''
+    parser = argparse.ArgumentParser(
+        description="Let's serve grids over HTTP!\n" +
+                    "GET /grid?font=4&nib=3.8&type=png returns the grid, fields are the long options\n" +
+                    "of nib4pimp.py (nib is short for nib-size) checked by the same rules, except those\n" +
+                    "writing files, starting processes or setting bands, images have {} megapixels at most.\n".format(
+                        max_pixels//1000//1000) +
+                    "Identical requests rendered at the same time share one render.\n" +
+                    "GET /metrics returns counters, latencies and throughput as JSON.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--host", type=str, metavar="HOST", default="127.0.0.1",
+        help="Address to listen on, default: 127.0.0.1")
+    parser.add_argument("--port", type=int, metavar="NUMBER", default=8000,
+        help="Port to listen on, 0 picks a free one, default: 8000")
+    parser.add_argument("-w", "--workers", type=int, metavar="NUMBER", default=os.cpu_count(),
+        help="Number of rendering processes, default: number of CPUs")
+    parser.add_argument("-l", "--max-in-flight", type=int, metavar="NUMBER",
+        help="Number of renders running or waiting for a process, further requests are answered\n" +
+             "with 503 and Retry-After until some of them finish, default: twice the workers")
+    parser.add_argument("--cache-dir", type=str, metavar="DIRPATH",
+        help="Keep rendered grids on disk between restarts")
+    args = parser.parse_args()
+
+    if args.max_in_flight is None:
+        args.max_in_flight = 2*args.workers
+    if args.workers < 1 or args.max_in_flight < 1:
+        print("[ERROR] Wrong number of workers or renders in flight")
+        sys.exit(1)
+    if not 0 <= args.port <= 65535:
+        print("[ERROR] Wrong port")
+        sys.exit(1)
+
+    return args
+
+
+def parse_query(query):
+    '''Turn the query string into prepared arguments with the rules of the command line,
+    return (args, nib_mm, errors)'''
+    row = {}
+    for field, value in parse_qsl(query, keep_blank_values=True):
+        row[aliases.get(field, field).replace("_", "-")] = value
+
+    forbidden = [field for field in row if field in forbidden_fields]
+    if forbidden:
+        return None, None, ["Fields not allowed: " + ", ".join(forbidden)]
+    unknown = [field for field in row if field not in allowed_fields]
+    if unknown:
+        return None, None, ["Unknown fields: " + ", ".join(unknown)]
+    args, errors = batch.parse_job(row, required=("font", "nib-size"))
+    if args is not None and "," in args.type:
+        errors.append("One filetype per request")
+    if errors:
+        return None, None, errors
+
+    nib4pimp.adjust_args(args)
+    nib_mm = args.nib_size
+    args = nib4pimp.prepare(args)
+    # Paper and resolution of PNG and SVG are turned into pixels:
+    if args.type != "PDF" and args.x_paper*args.y_paper > max_pixels:
+        return None, None, ["Image is bigger than {} megapixels".format(max_pixels//1000//1000)]
+
+    return args, nib_mm, []
+
+
+def render_job(args, nib_mm):
+    '''Render the grid of prepared arguments in the worker process, return its bytes'''
+    args.output_file = io.BytesIO()
+    # Big images are split into bands by the memory limit of nib4pimp.py:
+    nib4pimp.render(args, nib_mm)
+
+    return args.output_file.getvalue()
+
+
+def percentile(values, fraction):
+    '''Return the value below which the fraction of the sorted values lies'''
+    return values[round(fraction*(len(values) - 1))] if values else None
+
+
+class Metrics:
+    '''Counters, latencies and throughput of the service, updated by the event loop only'''
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {"requests": 0, "renders": 0, "coalesced": 0, "cached": 0, "rejected": 0, "bytes": 0}
+        self.statuses = collections.Counter()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.recent = collections.deque()
+
+    def count(self, name, number=1):
+        self.counters[name] += number
+
+    def record(self, status, seconds, size):
+        '''Count the finished request'''
+        now = time.monotonic()
+        self.counters["requests"] += 1
+        self.counters["bytes"] += size
+        self.statuses[status] += 1
+        self.latencies.append(seconds)
+        self.recent.append(now)
+        while self.recent[0] < now - recent_seconds:
+            self.recent.popleft()
+
+    def report(self, in_flight, cache_stats):
+        '''Return the JSON-ready report'''
+        uptime = time.monotonic() - self.started
+        while self.recent and self.recent[0] < time.monotonic() - recent_seconds:
+            self.recent.popleft()
+        latencies = sorted(self.latencies)
+
+        return {"uptime": uptime, "in_flight": in_flight, "counters": dict(self.counters),
+                "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+                "latency": {"count": len(latencies),
+                            "mean": sum(latencies)/len(latencies) if latencies else None,
+                            "p50": percentile(latencies, 0.5), "p90": percentile(latencies, 0.9),
+                            "p99": percentile(latencies, 0.99), "max": latencies[-1] if latencies else None},
+                "throughput": {"total": self.counters["requests"]/uptime if uptime else 0,
+                               "recent": len(self.recent)/min(recent_seconds, uptime) if uptime else 0},
+                "cache": cache_stats}
+
+
+class Busy(Exception):
+    '''Too many renders in flight'''
+
+
+class GridService:
+    '''HTTP front of the pool of rendering processes, identical renders in flight are shared by their requests'''
+
+    def __init__(self, pool, max_in_flight, cache=None):
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        self.cache = RenderCache() if cache is None else cache
+        self.renders = {}
+        self.metrics = Metrics()
+
+    async def grid(self, args, nib_mm):
+        '''Return (bytes, how they were got) of the grid, raise Busy above the limit of renders in flight'''
+        key = grid_key(args, nib_mm)
+        loop = asyncio.get_running_loop()
+        if key not in self.renders:
+            # The disk store is read by a thread, other connections go on meanwhile:
+            data = await loop.run_in_executor(None, self.cache.get, key)
+            if data is not None:
+                self.metrics.count("cached")
+                return data, "HIT"
+        # The same render may have started while the cache was read:
+        if key in self.renders:
+            self.metrics.count("coalesced")
+            # A client going away must not cancel the render shared with others:
+            return await asyncio.shield(self.renders[key]), "COALESCED"
+        if len(self.renders) >= self.max_in_flight:
+            self.metrics.count("rejected")
+            raise Busy()
+
+        self.metrics.count("renders")
+        render = loop.run_in_executor(self.pool, render_job, args, nib_mm)
+        self.renders[key] = render
+
+        def done(render):
+            if render.cancelled() or render.exception() is not None:
+                del self.renders[key]
+                return
+            # The finished render is shared until a thread has put it into the cache:
+            stored = loop.run_in_executor(None, self.cache.put, key, render.result())
+            stored.add_done_callback(lambda stored: self.renders.pop(key))
+        render.add_done_callback(done)
+
+        return await asyncio.shield(render), "MISS"
+
+    async def respond(self, path, query):
+        '''Return (status, content type, body, extra headers) of the request'''
+        if path == "/metrics":
+            report = self.metrics.report(len(self.renders), self.cache.stats())
+            return 200, "application/json", json.dumps(report, indent=1).encode(), []
+        if path != "/grid":
+            return 404, "application/json", json.dumps({"errors": ["Not found"]}).encode(), []
+
+        args, nib_mm, errors = parse_query(query)
+        if errors:
+            return 400, "application/json", json.dumps({"errors": errors}).encode(), []
+        try:
+            data, source = await self.grid(args, nib_mm)
+        except Busy:
+            return 503, "application/json", json.dumps({"errors": ["Too many renders in flight"]}).encode(), \
+                [("Retry-After", "1")]
+        except Exception as error:
+            return 500, "application/json", json.dumps({"errors": [str(error)]}).encode(), []
+
+        return 200, content_types[args.type], data, [
+            ("Content-Disposition", 'inline; filename="grid.{}"'.format(args.type.lower())), ("X-Cache", source)]
+
+    async def handle(self, reader, writer):
+        '''Answer HTTP/1.1 requests of the connection until the client closes it'''
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                start = time.perf_counter()
+
+                lines = head.decode("latin-1").split("\r\n")
+                request = lines[0].split(" ")
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                # Bodies of requests mean nothing here:
+                if int(headers.get("content-length", 0) or 0):
+                    await reader.readexactly(int(headers["content-length"]))
+                keep_alive = len(request) == 3 and request[2] == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+
+                if len(request) != 3:
+                    status, content_type, body, extra = 400, "application/json", b'{"errors": ["Bad request"]}', []
+                elif request[0] != "GET":
+                    status, content_type, body, extra = 405, "application/json", \
+                        b'{"errors": ["Only GET is allowed"]}', [("Allow", "GET")]
+                else:
+                    target = urlsplit(request[1])
+                    status, content_type, body, extra = await self.respond(target.path, target.query)
+
+                await self.write(writer, status, content_type, body, extra, keep_alive)
+                self.metrics.record(status, time.perf_counter() - start, len(body))
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write(self, writer, status, content_type, body, extra, keep_alive):
+        '''Write the response streaming the body as fast as the client takes it'''
+        headers = [("Content-Type", content_type), ("Content-Length", str(len(body))),
+                   ("Connection", "keep-alive" if keep_alive else "close")] + extra
+        writer.write(("HTTP/1.1 {} {}\r\n".format(status, reasons[status]) +
+                      "".join("{}: {}\r\n".format(name, value) for name, value in headers) + "\r\n").encode())
+        body = memoryview(body)
+        for start in range(0, len(body), write_size):
+            writer.write(body[start:start + write_size])
+            await writer.drain()
+        await writer.drain()
+
+
+async def start(service, host="127.0.0.1", port=0):
+    '''Start listening, return the asyncio server, port 0 picks a free port'''
+    return await asyncio.start_server(service.handle, host, port)
+
+
+async def serve(args):
+    '''Serve grids until interruption'''
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        service = GridService(pool, args.max_in_flight, RenderCache(directory=args.cache_dir))
+        server = await start(service, args.host, args.port)
+        for socket in server.sockets:
+            print("[INFO] Listening on http://{}:{}".format(*socket.getsockname()[:2]))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(main()))
+    except KeyboardInterrupt:
+        pass
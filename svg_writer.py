@@ -0,0 +1,196 @@
+import math
+import cairo
+
+from display_list import dot_corners, lattice_matrix
+
+line_caps = {cairo.LINE_CAP_BUTT: "butt", cairo.LINE_CAP_ROUND: "round", cairo.LINE_CAP_SQUARE: "square"}
+line_joins = {cairo.LINE_JOIN_MITER: "miter", cairo.LINE_JOIN_ROUND: "round", cairo.LINE_JOIN_BEVEL: "bevel"}
+
+
+def number(value):
+    '''Format the coordinate without needless digits'''
+    text = "{:.3f}".format(value).rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def color(rgba):
+    '''Return SVG color and opacity attributes of the paint'''
+    paint = "rgb({}%,{}%,{}%)".format(*[number(100*channel) for channel in rgba[:3]])
+    return paint, "" if rgba[3] == 1 else number(rgba[3])
+
+
+def path_data(ops):
+    '''Convert display list path operations to SVG path data'''
+    data = []
+    for op in ops:
+        if op[0] == "move_to":
+            data.append("M{} {}".format(number(op[1]), number(op[2])))
+        elif op[0] == "line_to":
+            data.append("L{} {}".format(number(op[1]), number(op[2])))
+        elif op[0] == "rectangle":
+            x, y, width, height = op[1:]
+            data.append("M{} {}h{}v{}h{}Z".format(number(x), number(y), number(width), number(height), number(-width)))
+        elif op[0] == "arc":
+            xc, yc, radius, angle1, angle2 = op[1:]
+            while angle2 < angle1:
+                angle2 += 2*math.pi
+            # Cairo starts the arc as a new sub-path, SVG arcs are split by halves of the circle at most:
+            parts = max(1, math.ceil((angle2 - angle1)/math.pi))
+            data.append("M{} {}".format(number(xc + radius*math.cos(angle1)), number(yc + radius*math.sin(angle1))))
+            for part in range(1, parts + 1):
+                angle = angle1 + (angle2 - angle1)*part/parts
+                data.append("A{r} {r} 0 0 1 {} {}".format(number(xc + radius*math.cos(angle)),
+                                                           number(yc + radius*math.sin(angle)), r=number(radius)))
+        elif op[0] == "lines":
+            data += ["M{} {}L{} {}".format(*[number(value) for value in segment]) for segment in op[1].tolist()]
+        elif op[0] == "rectangles":
+            data += ["M{} {}h{}v{}h{}Z".format(number(x), number(y), number(width), number(height), number(-width))
+                     for x, y, width, height in op[1].tolist()]
+        elif op[0] == "circles":
+            # Two halves of the circle from its rightmost point as cairo starts the arc at angle 0:
+            data += ["M{x1} {y}A{r} {r} 0 0 1 {x0} {y}A{r} {r} 0 0 1 {x1} {y}".format(
+                         x0=number(xc - radius), x1=number(xc + radius), y=number(yc), r=number(radius))
+                     for xc, yc, radius in op[1].tolist()]
+
+    return "".join(data)
+
+
+class SVGWriter:
+    '''Writer of display lists into SVG which defines every tile once and lets the viewer repeat it'''
+
+    def __init__(self, output, width, height):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.defs = []
+        self.cells = {}
+
+    def cell_id(self, cell):
+        '''Define the cell display list once as the group, return its id'''
+        if id(cell) not in self.cells:
+            self.cells[id(cell)] = "cell{}".format(len(self.cells) + 1)
+            self.defs.append('<g id="{}">{}</g>'.format(
+                self.cells[id(cell)], "".join(self.elements(cell))))
+        return self.cells[id(cell)]
+
+    def elements(self, display_list):
+        '''Return SVG elements of all display list layers in their order'''
+        elements = []
+        for key, ops in display_list.layers.items():
+            if key[0] == "tile":
+                for origin, size, counts in ops:
+                    elements += self.tiles(key[1], origin, size, counts)
+                continue
+            if key[0] == "dots":
+                for lattice in ops:
+                    elements += self.dots(key[1], *lattice)
+                continue
+            if not ops:
+                continue
+
+            paint, opacity = color(key[1])
+            if key[0] == "fill":
+                attributes = 'fill="{}"'.format(paint)
+                if opacity:
+                    attributes += ' fill-opacity="{}"'.format(opacity)
+            else:
+                attributes = 'fill="none" stroke="{}" stroke-width="{}" stroke-linecap="{}" stroke-linejoin="{}" ' \
+                             'stroke-miterlimit="10"'.format(paint, number(key[2]), line_caps[key[4]], line_joins[key[5]])
+                if opacity:
+                    attributes += ' stroke-opacity="{}"'.format(opacity)
+                dashes, offset = key[3]
+                if dashes:
+                    attributes += ' stroke-dasharray="{}"'.format(",".join(number(dash) for dash in dashes))
+                    if offset:
+                        attributes += ' stroke-dashoffset="{}"'.format(number(offset))
+            elements.append('<path {} d="{}"/>'.format(attributes, path_data(ops)))
+
+        return elements
+
+    def tiles(self, cell, origin, size, counts):
+        '''Return SVG elements repeating the cell with the pattern as paint_tiles() does'''
+        if counts[0] <= 0 or counts[1] <= 0:
+            return []
+
+        cell_id = self.cell_id(cell)
+        number_id = len(self.defs)
+        region = (origin[0], origin[1], counts[0]*size[0], counts[1]*size[1])
+
+        # One tile contains the cell and the overhangs of its neighbours:
+        uses = "".join('<use xlink:href="#{}" x="{}" y="{}"/>'.format(cell_id, number(dx), number(dy))
+                       for dx in (-size[0], 0, size[0]) for dy in (-size[1], 0, size[1]))
+        self.defs.append('<pattern id="tile{}" patternUnits="userSpaceOnUse" x="{}" y="{}" width="{}" height="{}">'
+                         '{}</pattern>'.format(number_id, number(origin[0]), number(origin[1]),
+                                               number(size[0]), number(size[1]), uses))
+        elements = ['<rect x="{}" y="{}" width="{}" height="{}" fill="url(#tile{})"/>'.format(
+            *[number(value) for value in region], number_id)]
+
+        # Outermost cells stick out of the tiled region, draw these parts where they are on the page:
+        edge_cells = set()
+        if region[0] > 0:
+            edge_cells.update((0, row) for row in range(counts[1]))
+        if region[0] + region[2] < self.width:
+            edge_cells.update((counts[0] - 1, row) for row in range(counts[1]))
+        if region[1] > 0:
+            edge_cells.update((column, 0) for column in range(counts[0]))
+        if region[1] + region[3] < self.height:
+            edge_cells.update((column, counts[1] - 1) for column in range(counts[0]))
+        if edge_cells:
+            outer = (region[0] - size[0], region[1] - size[1], region[2] + 2*size[0], region[3] + 2*size[1])
+            self.defs.append('<clipPath id="edge{}"><path clip-rule="evenodd" d="{}"/></clipPath>'.format(
+                number_id, path_data([("rectangle",) + outer, ("rectangle",) + region])))
+            elements.append('<g clip-path="url(#edge{})">{}</g>'.format(number_id, "".join(
+                '<use xlink:href="#{}" x="{}" y="{}"/>'.format(
+                    cell_id, number(origin[0] + column*size[0]), number(origin[1] + row*size[1]))
+                for column, row in sorted(edge_cells))))
+
+        return elements
+
+    def dots(self, rgba, origin, along, across, size, region):
+        '''Return SVG elements repeating the dot with the sheared pattern as paint_dots() does'''
+        number_id = len(self.defs)
+        xx, yx, xy, yy, x0, y0 = lattice_matrix(origin, along, across)
+        length_u, length_v = math.hypot(*along), math.hypot(*across)
+
+        # The dot and its neighbours sticking into the cell in the pattern space:
+        corners = []
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                corners.append([(xx*x + xy*y, yx*x + yy*y) for x, y in dot_corners(
+                    (i*along[0] + j*across[0], i*along[1] + j*across[1]), along, size)])
+        data = "".join("M{}Z".format("L".join("{} {}".format(number(x), number(y)) for x, y in dot))
+                       for dot in corners)
+
+        paint, opacity = color(rgba)
+        # The pattern transform maps the cell back to the lattice on the page:
+        self.defs.append('<pattern id="dots{}" patternUnits="userSpaceOnUse" width="{}" height="{}" '
+                         'patternTransform="matrix({} {} {} {} {} {})"><path fill="{}"{} d="{}"/></pattern>'.format(
+                             number_id, number(length_u), number(length_v),
+                             *["{:.9g}".format(value) for value in (along[0]/length_u, along[1]/length_u,
+                                                                    across[0]/length_v, across[1]/length_v)],
+                             number(origin[0]), number(origin[1]), paint,
+                             ' fill-opacity="{}"'.format(opacity) if opacity else "", data))
+
+        return ['<rect x="{}" y="{}" width="{}" height="{}" fill="url(#dots{})"/>'.format(
+            *[number(value) for value in region], number_id)]
+
+    def write(self, display_list):
+        '''Write the whole document with the display list'''
+        elements = self.elements(display_list)
+        document = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            'width="{w}pt" height="{h}pt" viewBox="0 0 {w} {h}" version="1.1">'.format(
+                w=number(self.width), h=number(self.height)),
+            "<defs>" + "".join(self.defs) + "</defs>"
+        ] + elements + ["</svg>", ""]
+        self.output.write("\n".join(document).encode())
+
+
+def write_svg(output, display_list, width, height):
+    '''Write the display list as SVG into the file path or the file-like output'''
+    if isinstance(output, str):
+        with open(output, "wb") as svg:
+            SVGWriter(svg, width, height).write(display_list)
+    else:
+        SVGWriter(output, width, height).write(display_list)
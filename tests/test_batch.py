@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+pytest.importorskip("cairo")
+
+import batch
+
+
+def test_bad_manifest_lines_fail_their_jobs_only(tmp_path):
+    good = {"font": "4", "nib-size": 3, "output-file": str(tmp_path/"grid.pdf")}
+    lines = [json.dumps(good), "", '{"font": "4", "nib-size": ', "[1, 2]", '"grid"',
+             json.dumps(dict(good, margins=100)), json.dumps(dict(good, **{"output-file": str(tmp_path/"other.pdf")}))]
+    manifest = tmp_path/"jobs.jsonl"
+    manifest.write_text("\n".join(lines) + "\n")
+
+    results = batch.run_batch(batch.read_manifest(str(manifest)), 2)
+    assert [number for number, ok, seconds, message, report in results] == [1, 2, 3, 4, 5, 6]
+    assert [ok for number, ok, seconds, message, report in results] == [True, False, False, False, False, True]
+    assert results[1][3].startswith("Line 3: ")
+    assert results[2][3] == results[3][3].replace("Line 5", "Line 4") == "Line 4: JSON object expected"
+    assert results[4][3] == "Wrong margin size"
+    assert (tmp_path/"grid.pdf").exists() and (tmp_path/"other.pdf").exists()
+
+
+def test_manifest_starting_with_a_bad_line_is_read_as_json_lines(tmp_path):
+    manifest = tmp_path/"jobs.jsonl"
+    manifest.write_text('[1]\n{"font": "4"}\n')
+
+    rows = batch.read_manifest(str(manifest))
+    assert str(rows[0]) == "Line 1: JSON object expected" and rows[1] == {"font": "4"}
@@ -0,0 +1,18 @@
+import json
+
+import pytest
+
+pytest.importorskip("cairo")
+
+import daemon
+from cache import RenderCache
+
+
+@pytest.mark.parametrize("request_fields, error", [
+    ({"id": 1, "font": "4"}, "Missing fields: nib-size"),
+    ({"id": 2, "font": "4", "nib-size": 3, "colour": "red"}, "Unknown fields: colour"),
+    ({"id": 3, "font": "4", "nib-size": 3, "type": "PDF,PNG"}, "One filetype per request")
+])
+def test_invalid_requests_are_answered_with_their_errors(request_fields, error):
+    reply = daemon.handle_request(json.dumps(request_fields), RenderCache())
+    assert reply["id"] == request_fields["id"] and not reply["ok"] and error in reply["error"]
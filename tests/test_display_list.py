@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("cairo")
+
+import display_list
+import nib4pimp
+
+
+@pytest.mark.parametrize("font", sorted(nib4pimp.font_dict))
+def test_gray_tiles_flush_cells_as_color_tiles(font, monkeypatch):
+    args, nib_mm = nib4pimp.grid_args(font, 0.2, paper_mm=(105, 148), fmt="PNG", dpi=300)
+    field = (args.x_paper, args.y_paper)
+    grid = nib4pimp.compile_grid(args.font, args.nib_size, field, args.margins, **nib4pimp.grid_options(args))
+    tiles = [tile for key, ops in grid.layers.items() if key[0] == "tile" for tile in ops]
+    cells = sum(counts[0]*counts[1] for origin, size, counts in tiles)
+
+    flushes = []
+    flush = display_list.DisplayList.flush
+    monkeypatch.setattr(display_list.DisplayList, "flush",
+                        lambda self, context: flushes.append(self) or flush(self, context))
+    counted = {}
+    for gray in (False, True):
+        surface, context = nib4pimp.create_surface(field, "PNG", None, gray)
+        del flushes[:]
+        grid.flush(context)
+        # The grid itself is flushed once, the rest are its cells:
+        counted[gray] = len(flushes) - 1
+        surface.finish()
+
+    assert tiles
+    assert counted[True] <= counted[False]
+    if cells > 1000:
+        assert counted[True] < cells/10
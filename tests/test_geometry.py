@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import pytest
+
+import geometry
+
+main_line_width = 0.5
+
+# Slanted lines of the grids as fonts.grids describes them:
+# (angle, spacing, start, rise, unit of the grid, dotted (dash length, gap in units))
+slanted = {
+    "antiqua sans": (25, 1/math.tan(math.radians(25)), 1, 1, math.cos(math.radians(25)), None),
+    "italic 45": (45, 2.5, 0, 0, 1, (0.5, 0.25)),
+    "italic 80": (80, 5, 0, 0, 1, None),
+    "copperplate": (66, 1/1.75, 0, 0, 1, None)
+}
+
+# (field, margins, step): A4 PDF in points, A4 PNG at 300 DPI, A0 PNG at 72 DPI, small nibs:
+pages = [
+    ((595, 842), 43, 9),
+    ((595, 842), 14, 1),
+    ((2480, 3508), 0, 35),
+    ((2384, 3370), 0, 3),
+    ((1000, 100), 5, 20)
+]
+
+
+def baseline_lines(field, ystart, y_step, y_delta):
+    '''Positions of the lines as the loops before the culling accumulated them'''
+    ypos = ystart
+    lines = []
+    while ypos < field[1] + y_delta:
+        lines.append(ypos)
+        ypos += y_step
+    return lines
+
+
+# Points sampled along every line:
+samples = 4001
+
+
+def visible_span(field, margins, ypos, y_delta):
+    '''Sampled part of the line from (0, ypos) to (field[0], ypos - y_delta) inside the printable area'''
+    t = np.linspace(0, 1, samples)
+    x = t*field[0]
+    y = ypos - t*y_delta
+    inside = (x >= margins) & (x <= field[0] - margins) & (y >= margins) & (y <= field[1] - margins)
+    return (t[inside].min(), t[inside].max()) if inside.sum() > 1 else None
+
+
+@pytest.mark.parametrize("font", sorted(slanted))
+@pytest.mark.parametrize("field, margins, step", pages)
+def test_diagonal_lines_keep_the_visible_result(font, field, margins, step):
+    angle, spacing, start, rise, unit, dotted = slanted[font]
+    unit *= step
+    slope = math.tan(math.radians(angle))
+    y_delta = field[0]*slope + rise*unit
+    y_step = spacing*unit*slope
+    ystart = margins + main_line_width*2 + start*unit
+    dash_period = dotted[0] + dotted[1]*unit if dotted else 0
+    length = math.hypot(field[0], y_delta)
+    tolerance = 1e-6*length
+
+    segments = geometry.diagonal_lines(field, margins, ystart, y_step, y_delta, dash_period)
+    # Every segment lies on the line starting at (0, ypos):
+    starts = segments[:, 0]/field[0]
+    ends = segments[:, 2]/field[0]
+    ypos = segments[:, 1] + starts*y_delta
+    assert np.allclose(segments[:, 3], ypos - ends*y_delta, atol=tolerance)
+
+    matched = set()
+    for line in baseline_lines(field, ystart, y_step, y_delta):
+        span = visible_span(field, margins, line, y_delta)
+        found = np.flatnonzero(np.abs(ypos - line) < tolerance)
+        if span is None:
+            assert not len(found) or ends[found[0]] - starts[found[0]] < 1e-3
+            matched.update(found.tolist())
+            continue
+        assert len(found) == 1, "visible line at {} is lost".format(line)
+        index = found[0]
+        matched.add(index)
+        # The segment covers the visible part and doesn't stick out of the printable area:
+        assert starts[index] <= span[0] + 1e-9 and ends[index] >= span[1] - 1e-9
+        assert ends[index] <= 1 - margins/field[0] + 1e-9
+        assert segments[index, 3] >= margins - tolerance
+        if dash_period:
+            # Dashes start where they started on the whole line, at most one period and one sample before the area:
+            periods = starts[index]*length/dash_period
+            assert abs(periods - round(periods)) < 1e-6
+            assert (span[0] - starts[index])*length <= dash_period + length/(samples - 1)
+        else:
+            assert starts[index] >= margins/field[0] - 1e-9
+            assert segments[index, 1] <= field[1] - margins + tolerance
+
+    assert matched == set(range(len(segments))), "lines outside of the page are drawn"
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("cairo")
+
+import nib4pimp
+
+
+@pytest.mark.parametrize("filetype, types", [
+    ("pdf", ["PDF"]), ("PDF, PNG", ["PDF", "PNG"]), ("PNG,PNG", ["PNG"]), (" svg ,png,SVG", ["SVG", "PNG"])
+])
+def test_filetypes_are_normalised_before_checks(filetype, types):
+    args = nib4pimp.build_parser().parse_args(["-f", "4", "-n", "3", "-t", filetype, "-o", "grid.pdf"])
+    assert nib4pimp.check_values(args) == []
+    outputs = nib4pimp.split_types(args)
+    assert [output.type for output in outputs] == types
+    if len(types) > 1:
+        assert [output.output_file for output in outputs] == ["grid." + filetype.lower() for filetype in types]
+
+
+def test_wrong_filetypes_are_refused():
+    args = nib4pimp.build_parser().parse_args(["-f", "4", "-n", "3", "-t", "PDF,,TIFF", "-o", "grid.pdf"])
+    assert "Wrong output filetype" in nib4pimp.check_values(args)
+
+
+@pytest.mark.parametrize("fmt", ["PDF,PNG", "PNG,PNG"])
+def test_grid_args_takes_one_filetype(fmt):
+    with pytest.raises(ValueError):
+        nib4pimp.grid_args("4", 3, fmt=fmt)
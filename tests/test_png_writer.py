@@ -0,0 +1,136 @@
+import io
+import zlib
+import struct
+
+import numpy as np
+import pytest
+
+cairo = pytest.importorskip("cairo")
+
+import nib4pimp
+import png_writer
+
+width, height = 37, 53
+# Heights of the bands written one after another, the second one is deflated by chunks as in a band process:
+bands = [11, 17, 1, 24]
+
+
+def chunks(data):
+    '''Return (type, data) of PNG chunks checking their CRC'''
+    assert data[:8] == png_writer.signature
+    position, result = 8, []
+    while position < len(data):
+        length, = struct.unpack(">I", data[position:position + 4])
+        chunk_type, body = data[position + 4:position + 8], data[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + body)
+        result.append((chunk_type, body))
+        position += 12 + length
+    return result
+
+
+def unfilter(raw, row_size, pixel_size):
+    '''Return the rows of PNG image data reversing the filter of every row'''
+    rows, prior = [], bytearray(row_size)
+    for start in range(0, len(raw), row_size + 1):
+        kind, row = raw[start], bytearray(raw[start + 1:start + 1 + row_size])
+        for index in range(row_size):
+            left = row[index - pixel_size] if index >= pixel_size else 0
+            above = prior[index]
+            up_left = prior[index - pixel_size] if index >= pixel_size else 0
+            if kind == 1:
+                row[index] = (row[index] + left) & 0xff
+            elif kind == 2:
+                row[index] = (row[index] + above) & 0xff
+            elif kind == 3:
+                row[index] = (row[index] + (left + above)//2) & 0xff
+            elif kind == 4:
+                estimate = left + above - up_left
+                distances = [abs(estimate - left), abs(estimate - above), abs(estimate - up_left)]
+                row[index] = (row[index] + [left, above, up_left][distances.index(min(distances))]) & 0xff
+            else:
+                assert kind == 0
+        rows.append(bytes(row))
+        prior = row
+    return b"".join(rows)
+
+
+def image(color_type):
+    '''Return the random image as (cairo surface format, surface values, expected PNG bytes)'''
+    rng = np.random.default_rng(color_type)
+    if color_type == 0:
+        values = rng.integers(0, 256, (height, width), np.uint8)
+        values[::5] = 255
+        return cairo.FORMAT_A8, values, values.tobytes()
+
+    # Opaque and transparent pixels are stored without rounding of premultiplied colors:
+    colors = rng.integers(0, 256, (height, width, 3), np.uint32)
+    alpha = np.where(rng.random((height, width)) < 0.3, 0, 255).astype(np.uint32)
+    colors[alpha == 0] = 0
+    values = alpha << 24 | colors[..., 0] << 16 | colors[..., 1] << 8 | colors[..., 2]
+    expected = np.concatenate([colors, alpha[..., None]], axis=2).astype(np.uint8)
+    return cairo.FORMAT_ARGB32, values, expected.tobytes()
+
+
+def surface(surface_format, values):
+    '''Return the image surface of the values'''
+    result = cairo.ImageSurface(surface_format, width, len(values))
+    result.flush()
+    dtype = np.uint8 if surface_format == cairo.FORMAT_A8 else np.uint32
+    data = np.frombuffer(result.get_data(), dtype).reshape(len(values), result.get_stride()//dtype().itemsize)
+    data[:, :width] = values
+    result.mark_dirty()
+    return result
+
+
+@pytest.mark.parametrize("level", [0, 6])
+@pytest.mark.parametrize("png_filter", sorted(png_writer.filters))
+@pytest.mark.parametrize("color_type", [0, 6])
+def test_stream_of_bands_and_chunks(color_type, png_filter, level, monkeypatch):
+    pixel_size = png_writer.pixel_sizes[color_type]
+    # Threads deflate chunks of a few rows:
+    monkeypatch.setattr(png_writer, "deflate_chunk_size", 3*width*pixel_size)
+    surface_format, values, expected = image(color_type)
+
+    output = io.BytesIO()
+    stream = png_writer.PNGStream(output, width, height, color_type, level, chunk_size=100, png_filter=png_filter,
+                                  threads=3)
+    top = 0
+    for number, band_height in enumerate(bands):
+        band = surface(surface_format, values[top:top + band_height])
+        if number == 1:
+            monkeypatch.setattr(nib4pimp, "draw_band", lambda *args: band)
+            pieces = nib4pimp.render_band(None, width, top, band_height, color_type == 0, (level, png_filter))
+            assert len(pieces) > 1 and sum(piece[3] for piece in pieces) == band_height
+            for piece in pieces:
+                stream.write_deflated(*piece)
+        else:
+            stream.write_surface(band)
+        top += band_height
+    stream.close()
+
+    parsed = chunks(output.getvalue())
+    assert [chunk_type for chunk_type, body in parsed][0] == b"IHDR" and parsed[-1] == (b"IEND", b"")
+    assert parsed[0][1] == struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    idats = [body for chunk_type, body in parsed if chunk_type == b"IDAT"]
+    assert len(idats) > 1
+    compressed = b"".join(idats)
+
+    raw = zlib.decompress(compressed)
+    assert len(raw) == height*(width*pixel_size + 1)
+    assert struct.unpack(">I", compressed[-4:])[0] == zlib.adler32(raw)
+    if png_filter != "ADAPTIVE":
+        # Only the first row and the rows after the band deflated apart lack the row above and fall back to SUB:
+        kinds = list(raw[::width*pixel_size + 1])
+        fallbacks = [0, bands[0], bands[0] + bands[1]]
+        assert kinds == [min(1, png_writer.filters[png_filter]) if row in fallbacks else png_writer.filters[png_filter]
+                         for row in range(height)]
+    assert unfilter(raw, width*pixel_size, pixel_size) == expected
+
+
+def test_adler32_combine():
+    rng = np.random.default_rng(1)
+    for first_size, second_size in [(0, 0), (0, 10), (10, 0), (1, 65521), (70000, 3), (123, 200000)]:
+        first, second = rng.bytes(first_size), rng.bytes(second_size)
+        assert png_writer.adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second)) == \
+            zlib.adler32(first + second)
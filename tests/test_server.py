@@ -0,0 +1,64 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("cairo")
+
+import server
+
+
+async def get(port, target):
+    '''Return (status, headers, body) of GET request to the local server'''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".format(target).encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in head[1:] if line)
+    body = await reader.readexactly(int(headers["Content-Length"]))
+    writer.close()
+    return int(head[0].split(" ")[1]), headers, body
+
+
+def serve(*steps):
+    '''Start the service on a free port, return responses to the steps one after another,
+    targets of a step are requested at once'''
+    async def run():
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            service = server.GridService(pool, 4)
+            grid_server = await server.start(service, port=0)
+            port = grid_server.sockets[0].getsockname()[1]
+            async with grid_server:
+                return [await asyncio.gather(*[get(port, target) for target in step]) for step in steps]
+    return asyncio.run(run())
+
+
+def test_grid_and_metrics():
+    png, pdfs, again, metrics = serve(["/grid?font=4&nib=3&type=png&resolution=72"],
+                                      ["/grid?font=4&nib=3&type=pdf"]*2,
+                                      ["/grid?font=4&nib=3&type=pdf"], ["/metrics"])
+    status, headers, body = png[0]
+    assert status == 200 and headers["Content-Type"] == "image/png" and body
+    assert [status for status, headers, body in pdfs] == [200, 200]
+    assert sorted(headers["X-Cache"] for status, headers, body in pdfs) == ["COALESCED", "MISS"]
+    # The finished render is shared until it is cached, either way it isn't rendered again:
+    assert again[0][1]["X-Cache"] in ["HIT", "COALESCED"] and again[0][2] == pdfs[0][2]
+
+    status, headers, body = metrics[0]
+    report = json.loads(body)
+    assert status == 200 and report["counters"]["requests"] == 4 and report["counters"]["renders"] == 2
+
+
+@pytest.mark.parametrize("query", [
+    "output-file=/tmp/grid.png", "output=/tmp/grid.png", "o=/tmp/grid.png", "out=/tmp/grid.png",
+    "proc=8", "cprof=/tmp/profile", "band-height=1", "band=1", "help=1", "output-file%3D/tmp/grid.png=1"
+])
+def test_fields_reaching_the_server_are_refused(query):
+    (status, headers, body), = serve(["/grid?font=4&nib=3&type=png&" + query])[0]
+    assert status == 400 and json.loads(body)["errors"]
+
+
+def test_huge_images_are_refused():
+    (status, headers, body), = serve(["/grid?font=4&nib=3&type=png&x-paper=5000&y-paper=5000&resolution=2400"])[0]
+    assert status == 400 and "megapixels" in json.loads(body)["errors"][0]